@@ -0,0 +1,66 @@
+"""load/store time vs file size for every file format and compression
+
+usage: python benchmark_compression.py [number of items]
+"""
+import random
+import sys
+import time
+from os import remove
+from os.path import getsize, join
+from tempfile import mkdtemp
+
+from json_database import JsonDatabase
+from json_database.utils.serializers import SERIALIZERS
+from json_database.utils.compression import COMPRESSIONS, check_compression
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+WORDS = ["noir", "drama", "comedy", "action", "the", "night", "city", "love",
+         "war", "last", "dark", "blue", "house", "man", "woman", "story"]
+
+
+def movie(i):
+    # same keys in every item, like a typical database
+    return {
+        "title": " ".join(random.choices(WORDS, k=random.randint(1, 5))),
+        "year": random.randint(1920, 2020),
+        "duration": random.randint(60, 200),
+        "rating": round(random.uniform(0, 5), 1),
+        "tags": random.sample(WORDS, 3),
+        "id": i
+    }
+
+
+random.seed(42)
+items = [movie(i) for i in range(N)]
+folder = mkdtemp()
+
+print("{} items".format(N))
+print("{:<14}{:<8}{:>12}{:>10}{:>10}".format(
+    "format", "compr.", "size (KB)", "store (s)", "load (s)"))
+for serializer_name, serializer in SERIALIZERS.items():
+    if not serializer.available:
+        continue
+    for compression in [None] + list(COMPRESSIONS):
+        try:
+            check_compression(compression)
+        except ImportError:
+            continue
+        path = join(folder, "movies.db")
+        db = JsonDatabase("movies", path, disable_lock=True,
+                          serializer=serializer_name, compression=compression)
+        for item in items:
+            db.append(item)
+
+        start = time.time()
+        db.commit()
+        store_time = time.time() - start
+
+        start = time.time()
+        loaded = JsonDatabase("movies", path, disable_lock=True)
+        load_time = time.time() - start
+        assert len(loaded) == N
+
+        print("{:<14}{:<8}{:>12.0f}{:>10.3f}{:>10.3f}".format(
+            serializer_name, compression or "-", getsize(path) / 1024,
+            store_time, load_time))
+        remove(path)
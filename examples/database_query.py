@@ -14,4 +14,8 @@ q = Query(db).above_or_equal("rating", 3).build()
 
 q = Query(db).value_contains_token("title", "noir", ignore_case=True).build()
 
-pprint(q)
\ No newline at end of file
+pprint(q)
+# filters are evaluated lazily in a single pass, stop early when possible
+first_noir = Query(db).value_contains_token("title", "noir", ignore_case=True).first()
+n_long = Query(db).above("duration", 130).count()
+top3 = Query(db).above_or_equal("rating", 3).limit(3).build()
@@ -2,14 +2,29 @@ from json_database.utils import *
 from json_database.exceptions import InvalidItemID, DatabaseNotCommitted, \
     SessionError, MatchError
 from os.path import expanduser, isdir, dirname, exists, isfile, join
-from os import makedirs, remove
-import json
+from os import makedirs, remove, replace, getpid, stat
+import hashlib
 import logging
 from pprint import pprint
 from xdg import BaseDirectory
-from json_database.utils.combo_lock import ComboLock, DummyLock
+from json_database.utils.combo_lock import ComboRWLock, DummyLock
+from json_database.utils.journal import Journal
+from json_database.utils.flusher import BackgroundFlusher
+from json_database.utils.watcher import FileWatcher, MISSING
+from json_database.utils.tracking import track, plain_copy, refill, \
+    TrackedDict, TrackedList
+from json_database.utils.undo import UndoLog
+from json_database.utils.serializers import get_serializer, \
+    detect_serializer
+from json_database.utils.compression import check_compression, \
+    compression_from_extension, detect_compression
+from json_database.indexes import INDEX_TYPES, ContentIndex
+from json_database.parallel import ProcessSearch
 
+from contextlib import contextmanager
+from itertools import chain
 from tempfile import gettempdir
+from threading import get_ident, Lock
 
 LOG = logging.getLogger("JsonDatabase")
 
@@ -17,21 +32,196 @@ LOG = logging.getLogger("JsonDatabase")
 class JsonStorage(dict):
     """
     persistent python dict
+
+    Arguments:
+        path (str): file to load from and store to
+        disable_lock (bool): do not lock the file across threads/processes,
+                             loads share the lock with each other, stores
+                             and removes are exclusive
+        journal (bool): append changes to a sidecar journal on store()
+                        instead of rewriting the whole file, the journal is
+                        folded back into the file once it grows past
+                        journal_threshold bytes
+        journal_threshold (int): journal size in bytes that triggers a
+                                 checkpoint, defaults to half the file size
+        write_behind (bool): store() only marks the data as dirty, a
+                             background thread writes it at most once every
+                             flush_interval seconds, call flush() to write
+                             immediately, pending data is flushed at exit
+        flush_interval (float): seconds between background writes
+        content_hash (bool): also hash the file on load and store, reload()
+                             then skips files that were rewritten with the
+                             same contents
+        serializer (str): file format used by store(), "json" (default),
+                          "json-compact", "orjson" or "msgpack", the format
+                          of existing files is detected on load
+        compression (str): compress the file with "gzip", "lzma" or "zstd",
+                           by default implied by the file extension (.gz,
+                           .xz, .zst), compressed files are detected on load
+        managed (iterable): keys changed through an api that records its
+                            changes, see manage()
+        manager: told about values nested in managed keys changing in
+                 place, as manager._nested_change(key, value) before the
+                 change, journals them on manager._record_nested(), see
+                 JsonDatabase
     """
 
-    def __init__(self, path, disable_lock=False):
+    def __init__(self, path, disable_lock=False, journal=False,
+                 journal_threshold=None, write_behind=False,
+                 flush_interval=1.0, content_hash=False, serializer="json",
+                 compression=None, managed=(), manager=None):
         super().__init__()
+        self.serializer = get_serializer(serializer)
+        if compression is None and path:
+            compression = compression_from_extension(path)
+        check_compression(compression)
+        self.compression = compression
         lock_path = join(gettempdir(), path.split("/")[-1] + ".lock")
         if disable_lock:
             LOG.warning("Lock is disabled, database might get corrupted if "
                         "different processes try to use it at same time!")
             self.lock = DummyLock(lock_path)
         else:
-            self.lock = ComboLock(lock_path)
+            self.lock = ComboRWLock(lock_path)
+        self._load_lock = Lock()  # loads share self.lock, not self
         self.path = path
+        self.journal = None
+        if journal and path:
+            self.journal = Journal(expanduser(path) + ".journal",
+                                   expanduser(path), journal_threshold)
+        self.flusher = None
+        if write_behind:
+            self.flusher = BackgroundFlusher(self._store, flush_interval)
+        self.content_hash = content_hash
+        self._changes = 0  # bumped on every change made in memory
+        self._synced = None  # (changes, file signature, hash) last load/store
+        self._dirty = set()  # keys changed since the last load / store
+        self._nested = set()  # keys changed in place, not journaled yet
+        self._managed = set(managed)  # keys whose value is not tracked
+        self.manager = manager
+        self._loose = set()  # keys whose value may change unnoticed
+        self._undo = None  # UndoLog of the current transaction
+        self.watcher = None
+        self.watch_callbacks = []
         if self.path:
             self.load_local(self.path)
 
+    def _record(self, op, key=None, **kwargs):
+        self._changes += 1
+        if key is not None:
+            self._dirty.add(key)
+        if self.journal is not None:
+            self.journal.record(op, key, **kwargs)
+
+    def _touch(self, key, container=None):
+        """ a tracked value of key changed in place, container None means
+        the value was handed out untracked and may change at any time """
+        if container is None:
+            # stays possibly changed until the key is replaced or deleted
+            self._loose.add(key)
+        elif key in self._managed and dict.get(self, key) is container:
+            # changes to the container itself are recorded by its manager
+            return
+        elif self._undo is not None:
+            # copy the top level value / database item before it changes
+            root = container._root
+            if self._undo.first_change(root):
+                self._undo.add(root._restore, plain_copy(root))
+        self._changes += 1
+        self._dirty.add(key)
+        if container is not None and self.manager is not None and \
+                key in self._managed:
+            # journaled by the manager, eg. one database item at a time
+            self.manager._nested_change(key, container._root)
+        elif self.journal is not None:
+            self._nested.add(key)
+
+    def manage(self, *keys):
+        """ values of keys are changed through an api that records its
+        changes (eg. JsonDatabase), their top level value is not tracked,
+        values nested in it still are when handed out with track_value() """
+        for key in keys:
+            self._managed.add(key)
+            value = dict.get(self, key)
+            if isinstance(value, (TrackedDict, TrackedList)):
+                dict.__setitem__(self, key, value.__reduce__()[1][0])
+
+    def track_value(self, key, container, idx):
+        """ tracked version of container[idx], replaces it in place """
+        value = container[idx]
+        tracked = track(value, self, key)
+        if tracked is not value:
+            container[idx] = tracked
+        return tracked
+
+    # dicts and lists read from the file are tracked, values assigned by
+    # the caller are stored as they are, the caller may still change them
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if key in self._managed and isinstance(value, (dict, list)):
+            # handed out as is, changes made to it are not recorded
+            self._touch(key, None)
+        return value
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def _track_children(self):
+        """ track the values just read from the file """
+        for key, value in dict.items(self):
+            if (type(value) is dict or type(value) is list) and \
+                    key not in self._managed:
+                dict.__setitem__(self, key, track(value, self, key))
+
+    def _is_tracked(self, key, value):
+        """ True if changes made in place to value are reported for key """
+        return (type(value) is TrackedDict or type(value) is TrackedList) \
+            and value._owner is self and value._key == key and \
+            value._root is value
+
+    # journaled dict operations
+    def __setitem__(self, key, value):
+        self._replacing(key)
+        super().__setitem__(key, value)
+        self._loose.discard(key)
+        if isinstance(value, (dict, list)) and key not in self._managed \
+                and not self._is_tracked(key, value):
+            self._touch(key, None)
+        self._record("set", key, value=value)
+
+    def __delitem__(self, key):
+        if key in self:
+            self._replacing(key)
+        super().__delitem__(key)
+        self._loose.discard(key)
+        self._record("del", key)
+
+    def pop(self, key, *args):
+        if key in self:
+            self._replacing(key)
+            self._loose.discard(key)
+            self._record("del", key)
+        return super().pop(key, *args)
+
+    def popitem(self):
+        key, value = super().popitem()
+        if self._undo is not None:
+            self._undo.add(dict.__setitem__, self, key, value)
+        self._loose.discard(key)
+        self._record("del", key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
     def load_local(self, path):
         """
             Load local json file into self.
@@ -39,14 +229,28 @@ class JsonStorage(dict):
             Args:
                 path (str): file to load
         """
-        with self.lock:
+        if self.flusher is not None and self.flusher.dirty:
+            # committed changes must hit the disk before reading it back
+            self.flusher.flush()
+        # replaying the journal may rewrite it, plain loads only read
+        lock = self.lock if self.journal is not None else \
+            self.lock.read_lock()
+        with lock, self._load_lock:
             path = expanduser(path)
             if exists(path) and isfile(path):
-                self.clear()
+                dict.clear(self)
+                self._synced = None
+                self._loose = set()
                 try:
-                    config = load_commented_json(path)
-                    for key in config:
-                        self[key] = config[key]
+                    # signature before reading, a write during the read
+                    # makes the next reload() read the file again
+                    signature = self._signature(path)
+                    dict.update(self, self._read(path))
+                    if self.journal is not None:
+                        self._replay_journal(path)
+                    self._track_children()
+                    if self.path and path == expanduser(self.path):
+                        self._mark_synced(signature)
                     LOG.debug("Json {} loaded".format(path))
                 except Exception as e:
                     LOG.error("Error loading json '{}'".format(path))
@@ -54,39 +258,402 @@ class JsonStorage(dict):
             else:
                 LOG.debug("Json '{}' not defined, skipping".format(path))
 
+    def _read(self, path):
+        compression = detect_compression(path)
+        return detect_serializer(path, self.serializer, compression).load_file(
+            path, compression)
+
+    def _replay_journal(self, path):
+        if path != self.journal.snapshot:
+            # loaded some other file, journal no longer matches memory
+            self.journal.invalidate()
+            return
+        self.journal.discard()
+        if self.journal.is_valid():
+            n = self.journal.replay(self)
+            LOG.debug("replayed {} journal entries".format(n))
+        elif isfile(self.journal.path):
+            LOG.warning("Journal '{}' does not match the stored file, "
+                        "ignoring it".format(self.journal.path))
+
     def clear(self):
-        for k in dict(self):
-            self.pop(k)
+        if self._undo is not None:
+            self._undo.add(dict.update, self, dict(self))
+        self._dirty.update(self)
+        dict.clear(self)
+        self._loose = set()
+        self._record("clear")
+
+    # transactions
+    def _replacing(self, key):
+        """ key is about to be replaced or deleted, keep the old value """
+        if self._undo is not None:
+            self._undo.add(self._put_back, key, dict.get(self, key, MISSING))
+
+    def _put_back(self, key, value):
+        if value is MISSING:
+            dict.pop(self, key, None)
+        else:
+            dict.__setitem__(self, key, value)
+
+    @contextmanager
+    def transaction(self, commit=True):
+        """
+            make a group of changes all or nothing
+
+            changes made inside the with block are stored once when it
+            ends, if it raises they are reverted in memory instead, in time
+            proportional to the changes, only values changed in place are
+            copied, once, before their first change, with commit=False
+            nothing is stored
+
+            nested transactions are savepoints, an error inside one only
+            reverts its own changes, only the outermost one stores
+
+            changes made in place to values read before the transaction
+            started are reverted too, values assigned as plain dicts / lists
+            can change unnoticed and are copied when it starts, except for
+            managed keys, reload() inside a transaction can not be rolled
+            back
+
+            with storage.transaction():
+                storage["a"] = 1
+                storage["b"]["c"] = 2
+        """
+        outer = self._undo is None
+        if outer:
+            self._undo = UndoLog()
+        journal = self.journal
+        self._undo.savepoint((self._changes, set(self._dirty),
+                              set(self._nested), set(self._loose),
+                              self._synced, journal and journal.position()))
+        for key in self._loose - self._managed:
+            value = dict.get(self, key)
+            self._undo.add(refill, value, plain_copy(value))
+        try:
+            yield self
+        except BaseException:
+            self._rolled_back(self._undo.rollback())
+            raise
+        else:
+            self._undo.release()
+        finally:
+            if outer:
+                self._undo = None
+        if outer and commit:
+            self.store()
+
+    def _rolled_back(self, state):
+        """ memory is back to state, restore the change tracking too """
+        changes, dirty, nested, loose, synced, pending = state
+        # never goes back, other code compares it to tell data versions apart
+        self._changes += 1
+        # values put back may still be referenced by the caller
+        self._loose.update(key for key in loose if key in self)
+        if self._synced is synced:
+            # not stored meanwhile, memory matches what it did back then
+            if synced is not None and synced[0] == changes:
+                self._synced = (self._changes,) + synced[1:]
+            self._dirty = dirty
+            self._nested = nested
+            if self.journal is not None and not self.journal.invalid:
+                self.journal.truncate(pending)
+            return
+        # the file has some of the reverted changes
+        self._dirty.update(dirty, self)
+        if self.journal is not None:
+            self.journal.invalidate()
+
+    # change detection
+    def _signature(self, path=None):
+        """ cheap fingerprint of the file (and journal) contents """
+        path = expanduser(path or self.path)
+        signature = []
+        for p in (path, self.journal and self.journal.path):
+            try:
+                st = stat(p) if p else None
+            except OSError:
+                st = None
+            if st is not None:
+                signature.append((st.st_mtime_ns, st.st_size, st.st_ino))
+            else:
+                signature.append(None)
+        return tuple(signature)
+
+    def _hash(self, path=None):
+        if not self.content_hash:
+            return None
+        h = hashlib.blake2b()
+        for p in (expanduser(path or self.path),
+                  self.journal and self.journal.path):
+            if p and isfile(p):
+                with open(p, "rb") as f:
+                    for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                        h.update(chunk)
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _mark_synced(self, signature=None, changes=None):
+        """ memory as of changes matches the file as of signature """
+        if changes is None:
+            changes = self._changes
+        self._synced = (changes, signature or self._signature(),
+                        self._hash())
+        if changes == self._changes:
+            self._dirty = set()
+            self._nested = set()
+        # else changed while a background thread was writing, still dirty
+
+    def is_synced(self):
+        """ True if neither memory nor the file changed since the last
+        load or store
+
+        changes made in place to values read from the file (eg.
+        self["a"]["b"] = 1) are detected, values assigned as plain dicts /
+        lists (eg. self["a"] = cfg) and the values of managed keys read
+        through the dict interface are not, while there are any the data is
+        never considered synced
+        """
+        if self._synced is None or self._loose:
+            return False
+        changes, signature, content = self._synced
+        if changes != self._changes:
+            return False
+        current = self._signature()
+        if current == signature:
+            return True
+        if content is not None and self._hash() == content:
+            # rewritten with the same contents
+            self._synced = (changes, current, content)
+            return True
+        return False
+
+    @property
+    def dirty(self):
+        """ True if memory changed since the last load or store """
+        return self._synced is None or \
+            self._synced[0] != self._changes or bool(self._loose)
+
+    def changes(self):
+        """ top level keys changed in memory since the last load or store
+
+        Returns:
+            dict: key -> current value, MISSING for removed keys
+        """
+        return {key: dict.get(self, key, MISSING)
+                for key in self._dirty | self._loose}
+
+    def reload(self, force=False):
+        """
+            load the file again, skipped if it did not change since it was
+            last loaded or stored and nothing changed in memory
 
-    def reload(self):
+            Returns:
+                bool: True if the file was read
+        """
+        if self.flusher is not None and self.flusher.dirty:
+            self.flusher.flush()
         if exists(self.path) and isfile(self.path):
+            if not force and self.is_synced():
+                return False
             self.load_local(self.path)
+            return True
         else:
             raise DatabaseNotCommitted
 
+    # watch mode
+    def watch(self, callback=None, interval=0.5, use_inotify=True):
+        """
+            apply changes other processes make to the file as they happen,
+            see refresh(), uses inotify if inotify_simple is installed,
+            else polls the file every interval seconds, changes made since
+            the last load or store are applied before returning
+
+            Args:
+                callback (callable): called from the watcher thread with
+                                     the changes applied by refresh()
+        """
+        if callback is not None and callback not in self.watch_callbacks:
+            self.watch_callbacks.append(callback)
+        if self.watcher is None:
+            paths = [expanduser(self.path)]
+            if self.journal is not None:
+                paths.append(self.journal.path)
+            self.watcher = FileWatcher(paths, self._on_file_change,
+                                       interval, use_inotify)
+        self.watcher.start()
+        # written before the watch was armed, cheap if nothing was
+        self._on_file_change()
+
+    def unwatch(self):
+        """ stop watching the file """
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+    def _on_file_change(self):
+        changes = self.refresh()
+        if changes:
+            for callback in list(self.watch_callbacks):
+                callback(changes)
+
+    def refresh(self):
+        """
+            read the file if it changed since the last load or store and
+            apply only the top level keys that differ from memory, values
+            that did not change keep their identity
+
+            unlike reload() nothing is read when only memory changed, when
+            the file did change uncommitted changes are lost as with reload()
+
+            Returns:
+                dict: key -> (old value, new value), old / new value is
+                      MISSING for added / removed keys
+        """
+        path = expanduser(self.path)
+        if self._synced is not None and \
+                self._synced[1] == self._signature(path):
+            return {}
+        if not isfile(path):
+            return {}
+        lock = self.lock if self.journal is not None else \
+            self.lock.read_lock()
+        with lock, self._load_lock:
+            signature = self._signature(path)
+            if self._synced is not None and self._synced[1] == signature:
+                return {}  # our own store finished meanwhile
+            try:
+                data = self._read(path)
+                if self.journal is not None and self.journal.is_valid():
+                    self.journal.replay(data)
+            except Exception as e:
+                LOG.error("Error refreshing json '{}'".format(path))
+                LOG.error(repr(e))
+                return {}
+            changes = {}
+            for key in list(self):
+                if key not in data:
+                    changes[key] = (dict.pop(self, key), MISSING)
+            for key, value in data.items():
+                old = dict.get(self, key, MISSING)
+                if old is MISSING or old != value:
+                    if key not in self._managed:
+                        value = track(value, self, key)
+                    dict.__setitem__(self, key, value)
+                    changes[key] = (old, value)
+            self._loose.difference_update(changes)
+            if self.journal is not None:
+                self.journal.discard()
+            self._mark_synced(signature)
+        if changes:
+            LOG.debug("Json {} refreshed, {} keys changed".format(
+                path, len(changes)))
+        return changes
+
     def store(self, path=None):
         """
             store the json db locally.
+
+            nothing is written if neither memory nor the file changed since
+            the last load or store, in write behind mode this only schedules
+            a background write
         """
+        if self.manager is not None and self.journal is not None:
+            self.manager._record_nested()
+        if not path or expanduser(path) == expanduser(self.path):
+            if self.is_synced():
+                return
+            if self.flusher is not None:
+                self.flusher.schedule()
+                return
+        self._store(path)
+
+    def flush(self):
+        """
+            write pending changes now, only needed in write behind mode
+        """
+        if self.flusher is not None:
+            self.flusher.flush()
+
+    def _store(self, path=None):
         with self.lock:
             path = path or self.path
             if not path:
                 LOG.warning("json db path not set")
                 return
             path = expanduser(path)
+            journaled = self.journal is not None and \
+                path == self.journal.snapshot
+            changes = self._changes
+            # values that may have changed unnoticed are journaled whole too
+            nested, self._nested = self._nested | self._loose, set()
+            if journaled and not self.journal.needs_checkpoint():
+                for key in nested:
+                    # changed in place, journal the whole value
+                    if key in self:
+                        self.journal.record("set", key,
+                                            value=dict.get(self, key))
+                    else:
+                        self.journal.record("del", key)
+                try:
+                    self.journal.write()
+                except Exception:
+                    self._nested |= nested
+                    raise
+                self._mark_synced(changes=changes)
+                return
             if dirname(path) and not isdir(dirname(path)):
                 makedirs(dirname(path))
-            with open(path, 'w', encoding="utf-8") as f:
-                json.dump(self, f, indent=4, ensure_ascii=False)
+            # write to a temporary file and rename it over the old one, so
+            # readers never see a half written file
+            tmp = "{}.{}.{}.tmp".format(path, getpid(), get_ident())
+            try:
+                self.serializer.dump_file(self, tmp, self.compression)
+                replace(tmp, path)
+            except Exception:
+                self._nested |= nested
+                raise
+            finally:
+                if isfile(tmp):
+                    remove(tmp)
+            if journaled:
+                self.journal.reset()
+                if self._changes != changes:
+                    # changed while writing, the snapshot may or may not
+                    # include those changes, write a full one next time
+                    self.journal.invalidate()
+            if self.path and path == expanduser(self.path):
+                self._mark_synced(changes=changes)
+
+    def checkpoint(self):
+        """
+            fold the journal back into the json file
+        """
+        if self.journal is not None:
+            self.journal.invalidate()
+        if self.flusher is not None:
+            self.flusher.cancel()
+        self._store()
 
     def remove(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+        self.unwatch()
         with self.lock:
             if isfile(self.path):
                 remove(self.path)
+            if self.journal is not None:
+                self.journal.reset()
+            self._synced = None
 
     def merge(self, conf, merge_lists=True, skip_empty=True, no_dupes=True,
               new_only=False):
+        # nested dicts are merged in place, journal their top level key
+        nested = [k for k, v in conf.items()
+                  if isinstance(v, dict) and isinstance(self.get(k), dict)]
         merge_dict(self, conf, merge_lists, skip_empty, no_dupes, new_only)
+        for key in nested:
+            self._record("set", key, value=self[key])
         return self
 
     def __enter__(self):
@@ -103,18 +670,66 @@ class JsonStorage(dict):
 
 
 class JsonDatabase(dict):
-    """ searchable persistent dict """
+    """ searchable persistent dict
+
+    by default item ids are the index of the item in the database and change
+    when items are removed, with stable_ids=True every item gets a permanent
+    id saved in the file, removed items leave a tombstone behind that is
+    cleaned up by compact()
+
+    extra keyword arguments are passed to the underlying JsonStorage
+    """
+    # compact once more than this many (and 1/4 of the) items are deleted
+    COMPACT_MIN = 64
+    # hand out items that report in place changes, so commit() can skip
+    # writing when nothing changed
+    _track_items = True
+
     def __init__(self,
             name,
             path=None,
             disable_lock=False,
-            extension="json"):
+            extension="json",
+            stable_ids=False,
+            **kwargs):
         super().__init__()
         self.name = name
         self.path = path or f"{name}.{extension}"
-        self.db = JsonStorage(self.path, disable_lock=disable_lock)
-        self.db[name] = []
-        self.db.load_local(self.path)
+        self.stable_ids = stable_ids
+        self._ids_key = f"__{name}_ids__"
+        self._next_id_key = f"__{name}_next_id__"
+        self._slots = {}  # item_id -> position, only used with stable_ids
+        self._tombstones = 0
+        # the storage already loads the file, only create the collection
+        self.db = self._open_storage(disable_lock, **kwargs)
+        if name not in self.db:
+            self.db[name] = []
+        self.indexes = {}
+        self._content = None  # built on first exact item lookup
+        # id -> (item, position hint) of items changed in place since the
+        # content index / the journal last saw them
+        self._unindexed = {}
+        self._unjournaled = {}
+        self._stale = False  # a rollback moved items, rebuild the indexes
+        self.parallel = None  # ProcessSearch, see enable_parallel()
+        self.watch_callbacks = []
+        self._load_ids()
+
+    def _open_storage(self, disable_lock=False, **kwargs):
+        # changes to the items list are recorded by the methods bellow
+        managed = (self.name, self._ids_key) if self._track_items else ()
+        return JsonStorage(self.path, disable_lock=disable_lock,
+                           managed=managed, manager=self, **kwargs)
+
+    # the items / ids lists are read without going through the storage dict
+    # interface, that would hand them out untracked
+    @property
+    def _items(self):
+        return dict.__getitem__(self.db, self.name)
+
+    @property
+    def _ids(self):
+        return dict.__getitem__(self.db, self._ids_key)
 
     # operator overloads
     def __enter__(self):
@@ -133,7 +748,9 @@ class JsonDatabase(dict):
         return str(jsonify_recursively(self))
 
     def __len__(self):
-        return len(self.db.get(self.name, []))
+        if self.stable_ids:
+            return len(self._slots)
+        return len(dict.get(self.db, self.name, []))
 
     def __getitem__(self, item):
         if not isinstance(item, int):
@@ -145,41 +762,402 @@ class JsonDatabase(dict):
                     raise InvalidItemID
         else:
             item_id = item
-        if item_id >= len(self.db[self.name]):
+        slot = self._slot(item_id)
+        if slot >= len(self._items):
             raise InvalidItemID
-        return self.db[self.name][item_id]
+        return self._tracked(slot)
 
     def __setitem__(self, item_id, value):
-        if not isinstance(item_id, int) or item_id >= len(self) or item_id < 0:
+        if not isinstance(item_id, int):
+            raise InvalidItemID
+        if self.stable_ids:
+            valid = item_id in self._slots
+        else:
+            valid = 0 <= item_id < len(self)
+        if not valid:
             raise InvalidItemID
         else:
             self.update_item(item_id, value)
 
     def __iter__(self):
-        for item in self.db[self.name]:
+        items = self._items
+        ids = self._ids if self.stable_ids else None
+        for slot, item in enumerate(items):
+            if ids is not None and ids[slot] is None:
+                continue
+            if self._track_items and \
+                    (type(item) is dict or type(item) is list):
+                item = self._tracked(slot)
             yield item
 
     def __contains__(self, item):
         item = jsonify_recursively(item)
-        return item in self.db[self.name]
+        items = self._items
+        for pos in self._content_index().lookup(item):
+            if items[pos] is item or items[pos] == item:
+                return True
+        return False
+
+    def _tracked(self, slot):
+        """ item at slot, changes made to it in place are committed """
+        items = self._items
+        if not self._track_items:
+            return items[slot]
+        return self.db.track_value(self.name, items, slot)
 
     # database
     def commit(self):
         """
-            store the json db locally.
+            store the json db locally, skipped if nothing changed since the
+            last load or commit
         """
         self.db.store(self.path)
 
-    def reset(self):
-        self.db.reload()
+    @property
+    def dirty(self):
+        """ True if there are uncommitted changes """
+        return self.db.dirty
+
+    def reset(self, force=False):
+        """
+            discard uncommitted changes and load the file again, skipped if
+            nothing changed since the last load or commit
+
+            Returns:
+                bool: True if the file was read
+        """
+        if not self.db.reload(force):
+            return False
+        self._unjournaled = {}
+        if self.name not in self.db:
+            self.db[self.name] = []
+        self._load_ids()
+        self.rebuild_indexes()
+        return True
+
+    @contextmanager
+    def transaction(self, commit=True):
+        """
+            make a group of changes all or nothing, committed once at the
+            end of the with block (unless commit=False) or reverted in
+            memory if it raises, see JsonStorage.transaction, nested
+            transactions are savepoints
+
+            with db.transaction():
+                db.update_item(0, {"name": "bob"})
+                db.remove_item(1)
+        """
+        try:
+            with self.db.transaction(commit):
+                yield self
+        finally:
+            if self._stale:
+                self._stale = False
+                self._load_ids()
+                self.rebuild_indexes()
+
+    def _on_rollback(self, func, *args):
+        """ func(*args) reverts a change if the transaction rolls back """
+        if self.db._undo is not None:
+            self.db._undo.add(func, *args)
+
+    def _undo_indexes(self):
+        # positions shifted by an earlier step, rebuilt at the end instead
+        return [] if self._stale else self._all_indexes()
+
+    def _drop_tail(self, length):
+        """ revert append / extend """
+        items = self._items
+        ids = self._ids if self.stable_ids else None
+        indexes = self._undo_indexes()
+        while len(items) > length:
+            items.pop()
+            if ids is not None:
+                self._slots.pop(ids.pop(), None)
+            for index in indexes:
+                index.remove(len(items))
+
+    def _put_item(self, slot, item):
+        """ revert update_item """
+        self._items[slot] = item
+        for index in self._undo_indexes():
+            index.update(slot, item)
+
+    def _insert_item(self, slot, item):
+        """ revert remove_item """
+        self._items.insert(slot, item)
+        self._stale = True
+
+    def _untombstone(self, slot, item_id, item):
+        self._items[slot] = item
+        self._ids[slot] = item_id
+        self._slots[item_id] = slot
+        self._tombstones -= 1
+        for index in self._undo_indexes():
+            index.update(slot, item)
+
+    def _mark_stale(self):
+        self._stale = True
+
+    def watch(self, callback=None, interval=0.5, use_inotify=True):
+        """
+            apply changes other processes commit as they happen, only the
+            items that changed are re-indexed
+
+            Args:
+                callback (callable): called from the watcher thread as
+                                     callback(added, updated, removed) with
+                                     lists of item ids
+        """
+        if callback is not None and callback not in self.watch_callbacks:
+            self.watch_callbacks.append(callback)
+        self.db.watch(self._on_storage_change, interval, use_inotify)
+
+    def unwatch(self):
+        self.db.unwatch()
+
+    def _on_storage_change(self, changes):
+        if self.name not in changes and self._ids_key not in changes:
+            return
+        if self.name not in self.db:
+            self.db[self.name] = []
+        items = self._items
+        old_items = changes.get(self.name, (items, items))[0] or []
+        if self.stable_ids:
+            old_ids = changes.get(self._ids_key, (None, None))[0]
+            if old_ids is None:
+                old_ids = self._ids
+            old = {i: old_items[s] for s, i in enumerate(old_ids or [])
+                   if i is not None and s < len(old_items)}
+            self._load_ids()
+            new = {i: items[s] for i, s in self._slots.items()}
+        else:
+            old = dict(enumerate(old_items))
+            new = dict(enumerate(items))
+        added = [i for i in new if i not in old]
+        removed = [i for i in old if i not in new]
+        updated = [i for i in new if i in old and new[i] != old[i]]
+        if added or removed or self._ids_key in changes:
+            # positions moved
+            self.rebuild_indexes()
+        else:
+            for item_id in updated:
+                for index in self._all_indexes():
+                    index.update(self._slot(item_id), new[item_id])
+        if added or updated or removed:
+            for callback in list(self.watch_callbacks):
+                callback(added, updated, removed)
+
+    def compact(self):
+        """
+            drop the tombstones left by remove_item, only used with
+            stable_ids, item ids are not affected
+        """
+        if not self.stable_ids or not self._tombstones:
+            return
+        items = self._items
+        ids = self._ids
+        live = [slot for slot, item_id in enumerate(ids)
+                if item_id is not None]
+        self._on_rollback(self._mark_stale)
+        self.db[self.name] = [items[slot] for slot in live]
+        self.db[self._ids_key] = [ids[slot] for slot in live]
+        self._load_ids()
+        self.rebuild_indexes()
+
+    # item_id <-> position in the items list
+    def _load_ids(self):
+        if not self.stable_ids:
+            return
+        items = self._items
+        ids = dict.get(self.db, self._ids_key)
+        if ids is None or len(ids) != len(items):
+            if ids is not None:
+                LOG.warning("item ids do not match the items, "
+                            "assigning new ids")
+            # first time this file is used with stable ids
+            ids = self.db[self._ids_key] = list(range(len(items)))
+        if self._next_id_key not in self.db:
+            self.db[self._next_id_key] = max(
+                [i for i in ids if i is not None] or [-1]) + 1
+        self._slots = {item_id: slot for slot, item_id in enumerate(ids)
+                       if item_id is not None}
+        self._tombstones = len(ids) - len(self._slots)
+
+    def _slot(self, item_id):
+        """ position of the item in the items list """
+        if not self.stable_ids:
+            return item_id
+        try:
+            return self._slots[item_id]
+        except (KeyError, TypeError):
+            raise InvalidItemID
+
+    def _id(self, slot):
+        """ item_id of the item at a position of the items list """
+        if not self.stable_ids:
+            return slot
+        return self._ids[slot]
+
+    def _assign_id(self, slot):
+        item_id = self.db[self._next_id_key]
+        self.db[self._next_id_key] = item_id + 1
+        self._ids.append(item_id)
+        self.db._record("append", self._ids_key, value=item_id)
+        self._slots[item_id] = slot
+        return item_id
+
+    def _assign_ids(self, slot, count):
+        """ ids for count items added from slot on """
+        first = self.db[self._next_id_key]
+        ids = list(range(first, first + count))
+        self.db[self._next_id_key] = first + count
+        self._ids.extend(ids)
+        self.db._record("extend", self._ids_key, values=ids)
+        self._slots.update(zip(ids, range(slot, slot + count)))
+        return ids
+
+    def _live(self):
+        """ (slot, item_id) of every item that is not a tombstone """
+        if not self.stable_ids:
+            return [(slot, slot) for slot in range(len(self._items))]
+        return [(slot, item_id)
+                for slot, item_id in enumerate(self._ids)
+                if item_id is not None]
 
     def print(self):
         pprint(jsonify_recursively(self))
 
+    # indexes
+    def create_index(self, field, index_type="hash"):
+        """ index the values of field to speed up searches
+
+        index types:
+            - "hash": equality and membership (search_by_value, Query.equal)
+            - "sorted": ranges (Query.above / bellow / in_range ...)
+            - "fuzzy": fuzzy matches (search_by_value / Query.contains_value
+              with fuzzy=True)
+            - "token": tokens / tags (Query.value_contains_token(s))
+
+        indexes are kept up to date by append / update_item / remove_item,
+        if you modify items in place call rebuild_indexes()
+        """
+        index = INDEX_TYPES[index_type](field)
+        self._rebuild_index(index)
+        self.indexes[(field, index_type)] = index
+        return index
+
+    def get_index(self, field, index_type="hash"):
+        return self.indexes.get((field, index_type))
+
+    def drop_index(self, field, index_type=None):
+        """ drop the index of field, all index types if not specified """
+        for key in list(self.indexes):
+            if key[0] == field and index_type in (None, key[1]):
+                self.indexes.pop(key)
+
+    def rebuild_indexes(self):
+        for index in self.indexes.values():
+            self._rebuild_index(index)
+        self._content = None
+
+    def _rebuild_index(self, index):
+        # indexes work with positions in the items list, tombstones included
+        index.rebuild(self._items)
+        if self.stable_ids and self._tombstones:
+            for slot, item_id in enumerate(self._ids):
+                if item_id is None:
+                    index.discard(slot)
+
+    def _content_index(self):
+        if self._content is None:
+            self._unindexed = {}
+            self._content = ContentIndex()
+            self._rebuild_index(self._content)
+        elif self._unindexed:
+            self._reindex_changed()
+        return self._content
+
+    def _nested_change(self, key, item):
+        """ item is about to be changed in place, called by the storage """
+        if key != self.name:
+            return
+        if self.db._undo is not None and not self._stale:
+            # a rollback restores the item behind the indexes' back
+            self._on_rollback(self._mark_stale)
+        indexed = self._content is not None and \
+            id(item) not in self._unindexed
+        journaled = self.db.journal is not None and \
+            id(item) not in self._unjournaled
+        if not indexed and not journaled:
+            return
+        pos = None
+        if self._content is not None:
+            # its position, while the content index still has its old hash
+            items = self._items
+            pos = next((pos for pos in self._content.lookup(item)
+                        if pos < len(items) and items[pos] is item), None)
+        if indexed:
+            self._unindexed[id(item)] = (item, pos)
+        if journaled:
+            self._unjournaled[id(item)] = (item, pos)
+
+    def _find_changed(self, changed):
+        """ (position, item) of the items changed in place still in the
+        database, changed is one of _unindexed / _unjournaled """
+        items = self._items
+        moved = {}
+        for key, (item, pos) in changed.items():
+            if pos is not None and pos < len(items) and items[pos] is item:
+                yield pos, item
+            else:
+                moved[key] = item
+        if moved:
+            # shifted by a removal (or removed), look for them
+            for pos, item in enumerate(items):
+                if id(item) in moved:
+                    yield pos, item
+
+    def _reindex_changed(self):
+        """ update the content index for the items changed in place """
+        changed, self._unindexed = self._unindexed, {}
+        for pos, item in self._find_changed(changed):
+            self._content.update(pos, item)
+
+    def _record_nested(self):
+        """ journal the items changed in place one by one, called by the
+        storage before storing """
+        if not self._unjournaled:
+            return
+        changed, self._unjournaled = self._unjournaled, {}
+        for pos, item in self._find_changed(changed):
+            self.db.journal.record("update", self.name, idx=pos, value=item)
+
+    def _all_indexes(self):
+        indexes = list(self.indexes.values())
+        if self._content is not None:
+            indexes.append(self._content)
+        return indexes
+
+    def _position(self, item_id):
+        """ normalize a (possibly negative) list index """
+        if item_id < 0:
+            return item_id + len(self)
+        return item_id
+
     # item manipulations
     def append(self, value):
+        """ add an item to database, returns the new item_id with stable_ids
+        or the number of items otherwise """
         value = jsonify_recursively(value)
-        self.db[self.name].append(value)
+        items = self._items
+        self._on_rollback(self._drop_tail, len(items))
+        items.append(value)
+        self.db._record("append", self.name, value=value)
+        for index in self._all_indexes():
+            index.append(value)
+        if self.stable_ids:
+            return self._assign_id(len(items) - 1)
         return len(self)
 
     def add_item(self, value, allow_duplicates=False):
@@ -188,27 +1166,80 @@ class JsonDatabase(dict):
          else only if no exact match is present
          """
         if allow_duplicates or value not in self:
-            self.append(value)
-            return len(self)
+            return self.append(value)
         return self.get_item_id(value)
 
+    def extend(self, values):
+        """ add many items at once, the indexes and the journal are updated
+        once for the whole batch
+
+        Returns:
+            list: item_ids of the new items
+        """
+        values = [jsonify_recursively(value) for value in values]
+        items = self._items
+        slot = len(items)
+        if not values:
+            return []
+        self._on_rollback(self._drop_tail, slot)
+        items.extend(values)
+        self.db._record("extend", self.name, values=values)
+        for index in self._all_indexes():
+            index.extend(values)
+        if self.stable_ids:
+            return self._assign_ids(slot, len(values))
+        return list(range(slot, slot + len(values)))
+
+    def add_items(self, values, allow_duplicates=False):
+        """ add many items at once, see add_item, items that are already in
+        the database or earlier in values are skipped unless
+        allow_duplicates is True
+
+        Returns:
+            list: item_id of every value, the existing item for skipped
+                  duplicates
+        """
+        values = [jsonify_recursively(value) for value in values]
+        if allow_duplicates:
+            return self.extend(values)
+        items = self._items
+        content = self._content_index()
+        new = []     # values to add
+        pending = {}  # hash -> positions in new
+        found = []   # per value: item_id, or -(position in new) - 1
+        for value in values:
+            h = ContentIndex._hash(value)
+            match = next((self._id(pos) for pos in content.lookup_hash(h)
+                          if items[pos] == value), None)
+            if match is None:
+                match = next((-pos - 1 for pos in pending.get(h, ())
+                              if new[pos] == value), None)
+            if match is None:
+                pending.setdefault(h, []).append(len(new))
+                match = -len(new) - 1
+                new.append(value)
+            found.append(match)
+        new_ids = self.extend(new)
+        return [i if i >= 0 else new_ids[-i - 1] for i in found]
+
     def match_item(self, value, match_strategy=None):
         """ match value to some item in database
         returns a list of matched items
         """
         value = jsonify_recursively(value)
         matches = []
-        for idx, item in enumerate(self):
+        items = self._items
 
-            # TODO match strategy
-            # - require exact match
-            # - require list of keys to match
-            # - require at least one of key list to match
-            # - require at exactly one of key list to match
+        # TODO match strategy
+        # - require exact match
+        # - require list of keys to match
+        # - require at least one of key list to match
+        # - require at exactly one of key list to match
 
-            # by default check for exact matches
-            if item == value:
-                matches.append((item, idx))
+        # by default check for exact matches
+        for idx in self._content_index().lookup(value):
+            if items[idx] == value:
+                matches.append((self._tracked(idx), self._id(idx)))
 
         return matches
 
@@ -244,7 +1275,7 @@ class JsonDatabase(dict):
     def get_item_id(self, item):
         """
         item_id is simply the index of the item in the database
-        WARNING: this is not immutable across sessions
+        WARNING: this is not immutable across sessions, unless stable_ids
         """
         for match, idx in self.match_item(item):
             return idx
@@ -253,28 +1284,224 @@ class JsonDatabase(dict):
     def update_item(self, item_id, new_item):
         """
         item_id is simply the index of the item in the database
-        WARNING: this is not immutable across sessions
+        WARNING: this is not immutable across sessions, unless stable_ids
         """
         new_item = jsonify_recursively(new_item)
-        self.db[self.name][item_id] = new_item
+        slot = self._position(self._slot(item_id))
+        self._on_rollback(self._put_item, slot, self._items[slot])
+        self._items[slot] = new_item
+        self.db._record("update", self.name, idx=slot, value=new_item)
+        for index in self._all_indexes():
+            index.update(slot, new_item)
 
     def remove_item(self, item_id):
         """
         item_id is simply the index of the item in the database
-        WARNING: this is not immutable across sessions
+        WARNING: this is not immutable across sessions, unless stable_ids
+        """
+        if self.stable_ids:
+            item = self._tombstone(item_id)
+            self._auto_compact()
+            return item
+        pos = self._position(item_id)
+        item = self._items.pop(item_id)
+        self._on_rollback(self._insert_item, pos, item)
+        self.db._record("remove", self.name, idx=item_id)
+        for index in self._all_indexes():
+            index.remove(pos)
+        return item
+
+    def _tombstone(self, item_id):
+        slot = self._slot(item_id)
+        items = self._items
+        item = items[slot]
+        self._on_rollback(self._untombstone, slot, item_id, item)
+        items[slot] = None
+        self._ids[slot] = None
+        del self._slots[item_id]
+        self.db._record("update", self.name, idx=slot, value=None)
+        self.db._record("update", self._ids_key, idx=slot, value=None)
+        for index in self._all_indexes():
+            index.discard(slot)
+        self._tombstones += 1
+        return item
+
+    def _auto_compact(self):
+        items = self._items
+        if self._tombstones > max(self.COMPACT_MIN, len(items) // 4):
+            self.compact()
+
+    def update_where(self, predicate, patch):
+        """ update every item predicate(item) is True for
+
+        Arguments:
+            predicate (callable): predicate(item) -> bool
+            patch (dict / callable): keys to set in the matching items, or
+                                     patch(item) -> new item
+
+        Returns:
+            list: item_ids of the updated items
+        """
+        if not callable(patch):
+            patch = jsonify_recursively(patch)
+        items = self._items
+        indexes = self._all_indexes()
+        updated = []
+        for slot, item_id in self._live():
+            item = items[slot]
+            if not predicate(item):
+                continue
+            if callable(patch):
+                new_item = jsonify_recursively(patch(item))
+            else:
+                new_item = dict(item)
+                new_item.update(patch)
+            self._on_rollback(self._put_item, slot, item)
+            items[slot] = new_item
+            self.db._record("update", self.name, idx=slot, value=new_item)
+            for index in indexes:
+                index.update(slot, new_item)
+            updated.append(item_id)
+        return updated
+
+    def remove_where(self, predicate):
+        """ remove every item predicate(item) is True for, the items list
+        is rewritten once instead of popping the items one by one
+
+        Returns:
+            list: the removed items
         """
-        return self.db[self.name].pop(item_id)
+        items = self._items
+        doomed = [(slot, item_id) for slot, item_id in self._live()
+                  if predicate(items[slot])]
+        if not doomed:
+            return []
+        if self.stable_ids:
+            removed = [self._tombstone(item_id) for _, item_id in doomed]
+            self._auto_compact()
+            return removed
+        drop = {slot for slot, _ in doomed}
+        removed = [items[slot] for slot, _ in doomed]
+        self._on_rollback(self._mark_stale)
+        self.db[self.name] = [item for slot, item in enumerate(items)
+                              if slot not in drop]
+        for index in self._all_indexes():
+            index.remove_many(drop)
+        return removed
 
     # search
-    def search_by_key(self, key, fuzzy=False, thresh=0.7, include_empty=False):
+    def enable_parallel(self, workers=None, min_items=None, mp_context=None):
+        """
+            run Query filters and searches that can not use an index in a
+            pool of worker processes, once the database has min_items items
+
+            the items are copied to the workers once and again only after
+            they change, results are the same as when searching serially
+        """
+        self.disable_parallel()
+        self.parallel = ProcessSearch(workers, min_items, mp_context)
+
+    def disable_parallel(self):
+        if self.parallel is not None:
+            self.parallel.close()
+            self.parallel = None
+
+    def _search_root(self, root_matches=False):
+        """ what the recursive searches walk, leaves out the item ids, if
+        the root itself can match the items are handed out as a list """
+        if not self._track_items:
+            if self.stable_ids:
+                return {self.name: self._items}
+            return self.db
+        items = list(self) if root_matches else _TrackedItems(self)
+        if self.stable_ids:
+            return {self.name: items}
+        return {key: items if key == self.name else value
+                for key, value in dict.items(self.db)}
+
+    def _search(self, func, root_matches, *args):
+        """ matches of func(root, *args), one of the iter_* recursive
+        searches, searching the items in the process pool if enabled and
+        nothing but the items can match """
+        if self.parallel is not None and not root_matches and \
+                (self.stable_ids or list(self.db) == [self.name]):
+            found = self.parallel.search(self, func, *args)
+            if found is not None:
+                return found
+        return func(self._search_root(root_matches), *args)
+
+    def _search_candidates(self, func, candidates, *args):
+        """ matches of func(item, *args) for the candidate positions given
+        by an index, in order """
+        return chain.from_iterable(func(self._tracked(pos), *args)
+                                   for pos in sorted(candidates))
+
+    def search_by_key(self, key, fuzzy=False, thresh=0.7, include_empty=False,
+                      limit=None):
+        """ dicts (nested in the database) that have key, (dict, score)
+        pairs from best to worst if fuzzy, only the first / best limit
+        ones if given """
         if fuzzy:
-            return get_key_recursively_fuzzy(self.db, key, thresh, not include_empty)
-        return get_key_recursively(self.db, key, not include_empty)
+            # the root holds the items under their collection name
+            root_matches = isinstance(key, str) and \
+                fuzzy_match(self.name, key) >= thresh
+            found = self._search(iter_key_recursively_fuzzy, root_matches,
+                                 key, thresh, not include_empty)
+            return best_matches(found, limit)
+        found = self._search(iter_key_recursively, key == self.name, key,
+                             not include_empty)
+        return first_matches(found, limit)
 
-    def search_by_value(self, key, value, fuzzy=False, thresh=0.7):
+    def search_by_value(self, key, value, fuzzy=False, thresh=0.7,
+                        limit=None):
+        """ dicts (nested in the database) where key == value, (dict, score)
+        pairs from best to worst if fuzzy, only the first / best limit
+        ones if given """
         if fuzzy:
-            return get_value_recursively_fuzzy(self.db, key, value, thresh)
-        return get_value_recursively(self.db, key, value)
+            candidates = self._index_lookup(key, value, thresh)
+            if candidates is None:
+                found = self._search(iter_value_recursively_fuzzy,
+                                     key == self.name, key, value, thresh)
+            else:
+                found = self._search_candidates(iter_value_recursively_fuzzy,
+                                                candidates, key, value, thresh)
+            return best_matches(found, limit)
+        candidates = self._index_lookup(key, value)
+        if candidates is None:
+            found = self._search(iter_value_recursively, key == self.name,
+                                 key, value)
+        else:
+            found = self._search_candidates(iter_value_recursively,
+                                            candidates, key, value)
+        return first_matches(found, limit)
+
+    def _index_lookup(self, key, value, thresh=None):
+        """ candidate positions for key == value (or fuzzy matches of value
+        if thresh is given) from an index, None if the whole storage needs
+        to be searched """
+        if thresh is None:
+            index = self.get_index(key)
+        else:
+            index = self.get_index(key, "fuzzy")
+        if index is None or key == self.name or \
+                (not self.stable_ids and list(self.db) != [self.name]):
+            # something other than the items could match
+            return None
+        if thresh is None:
+            return index.lookup(value)
+        return index.lookup(value, thresh)
+
+
+class _TrackedItems(list):
+    """ stands in for the items list in the recursive searches, hands out
+    the items tracked, it is empty, never let it be a search result """
+    def __init__(self, db):
+        super().__init__()
+        self.db = db
+
+    def __iter__(self):
+        for item in self.db:
+            yield item
 
 
 # XDG aware classes
@@ -286,10 +1513,10 @@ class JsonStorageXDG(JsonStorage):
                  name,
                  xdg_folder=BaseDirectory.xdg_cache_home,
                  disable_lock=False, subfolder="json_database",
-                 extension="json"):
+                 extension="json", **kwargs):
         self.name = name
         path = join(xdg_folder, subfolder, f"{name}.{extension}")
-        super().__init__(path, disable_lock=disable_lock)
+        super().__init__(path, disable_lock=disable_lock, **kwargs)
 
 
 class JsonDatabaseXDG(JsonDatabase):
@@ -297,14 +1524,16 @@ class JsonDatabaseXDG(JsonDatabase):
 
     def __init__(self, name, xdg_folder=BaseDirectory.xdg_data_home,
                  disable_lock=False, subfolder="json_database",
-                 extension="jsondb"):
+                 extension="jsondb", **kwargs):
         path = join(xdg_folder, subfolder, f"{name}.{extension}")
-        super().__init__(name, path, disable_lock=disable_lock, extension=extension)
+        super().__init__(name, path, disable_lock=disable_lock,
+                         extension=extension, **kwargs)
 
 class JsonConfigXDG(JsonStorageXDG):
     """ xdg respectful config files, using json_storage.JsonStorageXDG """
 
     def __init__(self, name, xdg_folder=BaseDirectory.xdg_config_home,
                  disable_lock=False, subfolder="json_database",
-                 extension="json"):
-        super().__init__(name, xdg_folder, disable_lock, subfolder, extension)
+                 extension="json", **kwargs):
+        super().__init__(name, xdg_folder, disable_lock, subfolder,
+                         extension, **kwargs)
@@ -0,0 +1,289 @@
+import asyncio
+from contextlib import asynccontextmanager
+from functools import partial
+
+from json_database import JsonStorage, JsonDatabase, LOG
+from json_database.exceptions import SessionError
+from json_database.search import Query
+
+
+class _Opening:
+    """ returned by open(), await it to get the opened object or use it
+    with async with to also store / commit it at the end """
+    def __init__(self, open_coro):
+        self._open_coro = open_coro
+        self._opened = None
+
+    def __await__(self):
+        return self._open_coro().__await__()
+
+    async def __aenter__(self):
+        self._opened = await self._open_coro()
+        return await self._opened.__aenter__()
+
+    async def __aexit__(self, _type, value, traceback):
+        return await self._opened.__aexit__(_type, value, traceback)
+
+
+class _AsyncWrapper:
+    """ runs the blocking methods of the wrapped object in an executor,
+    one at a time, everything else is forwarded as is """
+    def __init__(self, wrapped, executor=None):
+        self._wrapped = wrapped
+        self.executor = executor
+        self._lock = None
+        self._writer_lock = None
+        self._writer = None  # task running a transaction
+
+    @property
+    def writer_lock(self):
+        """ asyncio lock serializing the transactions of this object, held
+        for the whole transaction, blocking calls inside it still go
+        through loop_lock """
+        if self._writer_lock is None:
+            self._writer_lock = asyncio.Lock()
+        return self._writer_lock
+
+    @property
+    def loop_lock(self):
+        """ asyncio lock serializing the blocking calls of this object """
+        if self._lock is None:
+            # created on first use, inside the running loop
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _run(self, func, *args, **kwargs):
+        """ func(*args, **kwargs) in the executor, after the blocking calls
+        started before it are done """
+        loop = asyncio.get_running_loop()
+        async with self.loop_lock:
+            return await loop.run_in_executor(
+                self.executor, partial(func, *args, **kwargs))
+
+    @asynccontextmanager
+    async def _transaction(self, begin, commit):
+        """ begin(commit=False) in the current task, the transactions of
+        other tasks wait for it to end, await commit() once it succeeds """
+        task = asyncio.current_task()
+        if self._writer is task:
+            # nested, a savepoint of the transaction this task is running
+            with begin(commit=False):
+                yield self
+            return
+        async with self.writer_lock:
+            self._writer = task
+            try:
+                with begin(commit=False):
+                    yield self
+                await commit()
+            finally:
+                self._writer = None
+
+    def __getattr__(self, item):
+        if item == "_wrapped":
+            raise AttributeError(item)
+        return getattr(self._wrapped, item)
+
+    def __getitem__(self, item):
+        return self._wrapped[item]
+
+    def __setitem__(self, key, value):
+        self._wrapped[key] = value
+
+    def __delitem__(self, key):
+        del self._wrapped[key]
+
+    def __contains__(self, item):
+        return item in self._wrapped
+
+    def __iter__(self):
+        return iter(self._wrapped)
+
+    def __len__(self):
+        return len(self._wrapped)
+
+    def __repr__(self):
+        return repr(self._wrapped)
+
+
+class AsyncJsonStorage(_AsyncWrapper):
+    """ asyncio front end of a JsonStorage
+
+    file io, (de)serialization and waiting for the file lock held by other
+    processes run in an executor (the loop default one if None) instead of
+    blocking the event loop, an asyncio lock lets one of them run at a
+    time, dict access is forwarded to the storage and stays synchronous
+
+    other tasks should not change the data while a store() is running, it
+    is being read from another thread
+
+    storage = await AsyncJsonStorage.open("config.json")
+    storage["lang"] = "en-us"
+    await storage.store()
+
+    async with AsyncJsonStorage.open("config.json") as storage:
+        storage["lang"] = "en-us"  # stored when the block ends
+
+    Arguments:
+        storage (JsonStorage): storage to wrap
+        executor (concurrent.futures.Executor): runs the blocking calls
+    """
+    def __init__(self, storage, executor=None):
+        super().__init__(storage, executor)
+        self.storage = storage
+
+    @classmethod
+    def open(cls, path, executor=None, **kwargs):
+        """ load a JsonStorage without blocking the loop, extra keyword
+        arguments are passed to JsonStorage """
+        async def _open():
+            loop = asyncio.get_running_loop()
+            storage = await loop.run_in_executor(
+                executor, partial(JsonStorage, path, **kwargs))
+            return cls(storage, executor)
+        return _Opening(_open)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, _type, value, traceback):
+        """ stores the changes """
+        try:
+            await self.store()
+        except Exception as e:
+            LOG.error(e)
+            raise SessionError
+
+    async def load_local(self, path):
+        await self._run(self.storage.load_local, path)
+
+    async def reload(self, force=False):
+        return await self._run(self.storage.reload, force)
+
+    async def refresh(self):
+        return await self._run(self.storage.refresh)
+
+    async def store(self, path=None):
+        await self._run(self.storage.store, path)
+
+    async def flush(self):
+        await self._run(self.storage.flush)
+
+    async def checkpoint(self):
+        await self._run(self.storage.checkpoint)
+
+    async def remove(self):
+        await self._run(self.storage.remove)
+
+    def transaction(self):
+        """ see JsonStorage.transaction, transactions of other tasks wait
+        for it to end, changes other tasks make without one during the
+        transaction are reverted with it """
+        return self._transaction(self.storage.transaction, self.store)
+
+
+class AsyncJsonDatabase(_AsyncWrapper):
+    """ asyncio front end of a JsonDatabase
+
+    commit(), reset() and searches run in an executor like the blocking
+    calls of AsyncJsonStorage, adding / updating / removing items only
+    changes memory and stays synchronous
+
+    db = await AsyncJsonDatabase.open("users", "users.db")
+    db.add_item({"name": "bob"})
+    await db.commit()
+    bobs = await db.query().equal("name", "bob").build()
+
+    async with AsyncJsonDatabase.open("users", "users.db") as db:
+        db.add_item({"name": "bob"})  # committed when the block ends
+
+    Arguments:
+        database (JsonDatabase): database to wrap, any JsonDatabase
+                                 subclass (eg. PagedJsonDatabase) works
+        executor (concurrent.futures.Executor): runs the blocking calls
+    """
+    def __init__(self, database, executor=None):
+        super().__init__(database, executor)
+        self.database = database
+
+    @classmethod
+    def open(cls, name, path=None, executor=None, **kwargs):
+        """ load a JsonDatabase without blocking the loop, extra keyword
+        arguments are passed to JsonDatabase """
+        async def _open():
+            loop = asyncio.get_running_loop()
+            database = await loop.run_in_executor(
+                executor, partial(JsonDatabase, name, path, **kwargs))
+            return cls(database, executor)
+        return _Opening(_open)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, _type, value, traceback):
+        """ Commits changes """
+        try:
+            await self.commit()
+        except Exception as e:
+            LOG.error(e)
+            raise SessionError
+
+    async def commit(self):
+        await self._run(self.database.commit)
+
+    async def reset(self, force=False):
+        return await self._run(self.database.reset, force)
+
+    async def reload(self, force=False):
+        """ same as reset() """
+        return await self.reset(force)
+
+    def transaction(self):
+        """ see JsonDatabase.transaction, transactions of other tasks wait
+        for it to end, changes other tasks make without one during the
+        transaction are reverted with it """
+        return self._transaction(self.database.transaction, self.commit)
+
+    # search
+    async def search_by_key(self, key, fuzzy=False, thresh=0.7,
+                            include_empty=False, limit=None):
+        return await self._run(self.database.search_by_key, key, fuzzy,
+                               thresh, include_empty, limit)
+
+    async def search_by_value(self, key, value, fuzzy=False, thresh=0.7,
+                              limit=None):
+        return await self._run(self.database.search_by_value, key, value,
+                               fuzzy, thresh, limit)
+
+    def query(self):
+        return AsyncQuery(self)
+
+
+class AsyncQuery(Query):
+    """ Query whose results are computed in the executor of an
+    AsyncJsonDatabase, filters are chained as usual, results are awaited
+
+    results = await AsyncQuery(db).above("age", 18).limit(10).build()
+
+    async for item in db.query().equal("name", "bob"):
+        ...
+    """
+    def __init__(self, db):
+        super().__init__(db.database)
+        self.async_db = db
+
+    async def build(self):
+        return await self.async_db._run(super().build)
+
+    async def first(self):
+        return await self.async_db._run(super().first)
+
+    async def count(self):
+        return await self.async_db._run(super().count)
+
+    async def exists(self):
+        return await self.async_db._run(super().exists)
+
+    async def __aiter__(self):
+        for item in await self.build():
+            yield item
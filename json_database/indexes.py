@@ -0,0 +1,731 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from math import isnan
+from numbers import Number
+from json_database.utils import freeze, shared_chars
+
+_MISSING = object()
+
+
+def _nested_values(item, field):
+    """ values of field in item and in every dict nested in it, these are
+    the same dicts get_value_recursively looks at """
+    found = []
+    stack = [item]
+    while stack:
+        d = stack.pop()
+        for key, value in d.items():
+            if key == field:
+                found.append(value)
+            if isinstance(value, dict):
+                stack.append(value)
+            elif isinstance(value, list):
+                stack.extend(i for i in value if isinstance(i, dict))
+    return found
+
+
+class _SlotIndex:
+    """ base of the indexes whose tables map keys to item slots
+
+    a slot is the position an item had when it was indexed, removing an
+    item leaves a hole instead of moving every item after it to a new
+    slot, lookups and updates translate between slots and positions, the
+    holes are folded in (reindexing once) when they make up a quarter of
+    the slots, so removing is cheap wherever the item is
+    """
+    _EMPTY = None  # entry of a removed item
+
+    def __init__(self):
+        self._entries = []  # per slot: what the tables hold for the item
+        self._holes = []    # sorted slots of removed items
+
+    def __len__(self):
+        return len(self._entries) - len(self._holes)
+
+    def _slot(self, pos):
+        """ slot of the item at position pos """
+        holes = self._holes
+        # holes[i] - i never decreases, count the holes before the slot
+        lo, hi = 0, len(holes)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if holes[mid] - mid <= pos:
+                lo = mid + 1
+            else:
+                hi = mid
+        return pos + lo
+
+    def _positions(self, slots):
+        """ positions of the items in slots """
+        holes = self._holes
+        if not holes:
+            return slots
+        return {s - bisect_left(holes, s) for s in slots}
+
+    def _fold_holes(self):
+        holes = set(self._holes)
+        self._reindex([e for s, e in enumerate(self._entries)
+                       if s not in holes])
+
+    def update(self, pos, item):
+        slot = self._slot(pos)
+        self._discard(slot, self._entries[slot])
+        self._entries[slot] = self._entry(item)
+        self._add(slot, self._entries[slot])
+
+    def remove(self, pos):
+        slot = self._slot(pos)
+        entries = self._entries
+        self._discard(slot, entries[slot])
+        if slot == len(entries) - 1:
+            entries.pop()
+            while self._holes and self._holes[-1] == len(entries) - 1:
+                self._holes.pop()
+                entries.pop()
+            return
+        entries[slot] = self._EMPTY
+        insort(self._holes, slot)
+        if len(self._holes) * 4 > len(entries):
+            self._fold_holes()
+
+    def remove_many(self, positions):
+        """ remove the items at positions, reindexing only once """
+        drop = {self._slot(pos) for pos in positions}
+        drop.update(self._holes)
+        self._reindex([e for s, e in enumerate(self._entries)
+                       if s not in drop])
+
+    def discard(self, pos):
+        """ forget the item at pos without shifting the others """
+        slot = self._slot(pos)
+        self._discard(slot, self._entries[slot])
+        self._entries[slot] = self._EMPTY
+
+
+class HashIndex(_SlotIndex):
+    """ maps values of a field to the positions of the items holding them
+
+    lookups return candidate positions, callers are expected to check the
+    candidates against their original predicate, positions that can not
+    be indexed (unhashable values) are always returned as candidates
+
+    Arguments:
+        field (str): key to index, matched at any nesting level like
+                     JsonDatabase.search_by_value does
+    """
+    _EMPTY = ((), (), None)
+
+    def __init__(self, field):
+        super().__init__()
+        self.field = field
+        self.values = {}    # frozen value -> slots
+        self.members = {}   # frozen list element / dict key -> slots
+        self.scan = set()   # slots where "in" must check the item
+        self.unhashable = set()
+
+    def _entry(self, item):
+        if not isinstance(item, dict):
+            return (), (), None
+        try:
+            values = {freeze(v) for v in _nested_values(item, self.field)}
+            members = ()
+            scan = False
+            if self.field in item:
+                value = item[self.field]
+                if isinstance(value, (list, dict)):
+                    members = {freeze(v) for v in value}
+                else:
+                    scan = True
+            return values, members, scan
+        except TypeError:
+            return (), (), "unhashable"
+
+    def _add(self, pos, entry):
+        values, members, flag = entry
+        for v in values:
+            self.values.setdefault(v, set()).add(pos)
+        for m in members:
+            self.members.setdefault(m, set()).add(pos)
+        if flag == "unhashable":
+            self.unhashable.add(pos)
+        elif flag:
+            self.scan.add(pos)
+
+    def _discard(self, pos, entry):
+        values, members, flag = entry
+        for table, keys in ((self.values, values), (self.members, members)):
+            for k in keys:
+                positions = table[k]
+                positions.discard(pos)
+                if not positions:
+                    del table[k]
+        self.scan.discard(pos)
+        self.unhashable.discard(pos)
+
+    # maintenance
+    def _reindex(self, entries):
+        self.values = {}
+        self.members = {}
+        self.scan = set()
+        self.unhashable = set()
+        self._entries = entries
+        self._holes = []
+        for pos, entry in enumerate(entries):
+            self._add(pos, entry)
+
+    def rebuild(self, items):
+        self._reindex([self._entry(item) for item in items])
+
+    def append(self, item):
+        entry = self._entry(item)
+        self._entries.append(entry)
+        self._add(len(self._entries) - 1, entry)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    # lookups
+    def lookup(self, value):
+        """ positions of items where field == value (at any nesting level)
+
+        Returns:
+            set: candidate positions, None if value can not be indexed
+        """
+        try:
+            key = freeze(value)
+        except TypeError:
+            return None
+        return self._positions(self.values.get(key, set()) | self.unhashable)
+
+    def lookup_member(self, value):
+        """ positions of items where value in item[field]
+
+        Returns:
+            set: candidate positions, None if value can not be indexed
+        """
+        try:
+            key = freeze(value)
+        except TypeError:
+            return None
+        return self._positions(self.members.get(key, set()) | self.scan |
+                               self.unhashable)
+
+
+def _family(value):
+    """ values of the same family can be compared with each other """
+    if isinstance(value, Number) and not isinstance(value, complex):
+        try:
+            if isnan(value):
+                return None
+        except (TypeError, ValueError):
+            return None
+        return "number"
+    if isinstance(value, str):
+        return "str"
+    return None
+
+
+class SortedIndex(_SlotIndex):
+    """ keeps the values of a top level field sorted to answer range queries
+
+    only truthy values are indexed, like Query.contains_key requires, range
+    lookups are only answered when every indexed value can be compared with
+    the queried value, otherwise the caller has to scan the items
+
+    Arguments:
+        field (str): top level key to index
+    """
+    _EMPTY = _MISSING
+
+    def __init__(self, field):
+        super().__init__()
+        self.field = field
+        self.families = {}   # family -> [sorted values, item slots]
+        self.unsorted = 0    # number of values that can not be sorted
+
+    def _entry(self, item):
+        if isinstance(item, dict):
+            value = item.get(self.field)
+            if value:
+                return value
+        return _MISSING
+
+    def _add(self, pos, value):
+        if value is _MISSING:
+            return
+        family = _family(value)
+        if family is None:
+            self.unsorted += 1
+            return
+        keys, positions = self.families.setdefault(family, ([], []))
+        i = bisect_right(keys, value)
+        keys.insert(i, value)
+        positions.insert(i, pos)
+
+    def _discard(self, pos, value):
+        if value is _MISSING:
+            return
+        family = _family(value)
+        if family is None:
+            self.unsorted -= 1
+            return
+        keys, positions = self.families[family]
+        i = bisect_left(keys, value)
+        while positions[i] != pos:
+            i += 1
+        del keys[i]
+        del positions[i]
+        if not keys:
+            del self.families[family]
+
+    # maintenance
+    def _reindex(self, entries):
+        self._entries = entries
+        self._holes = []
+        self.families = {}
+        self.unsorted = 0
+        grouped = {}
+        for pos, value in enumerate(self._entries):
+            if value is _MISSING:
+                continue
+            family = _family(value)
+            if family is None:
+                self.unsorted += 1
+            else:
+                grouped.setdefault(family, []).append((value, pos))
+        for family, pairs in grouped.items():
+            pairs.sort(key=lambda p: p[0])
+            self.families[family] = ([v for v, _ in pairs],
+                                     [pos for _, pos in pairs])
+
+    def rebuild(self, items):
+        self._reindex([self._entry(item) for item in items])
+
+    def append(self, item):
+        value = self._entry(item)
+        self._entries.append(value)
+        self._add(len(self._entries) - 1, value)
+
+    def extend(self, items):
+        values = [self._entry(item) for item in items]
+        if len(values) * 8 < len(self._entries):
+            # few items, inserting them one by one is cheaper than sorting
+            for value in values:
+                self._entries.append(value)
+                self._add(len(self._entries) - 1, value)
+        else:
+            holes = set(self._holes)
+            self._reindex([e for s, e in enumerate(self._entries)
+                           if s not in holes] + values)
+
+    def remove_many(self, positions):
+        """ remove the items at positions, the sort order is kept """
+        drop = {self._slot(pos) for pos in positions}
+        drop.update(self._holes)
+        moved = {}  # old slot -> new slot
+        entries = []
+        for slot, value in enumerate(self._entries):
+            if slot in drop:
+                if value is not _MISSING and _family(value) is None:
+                    self.unsorted -= 1
+                continue
+            moved[slot] = len(entries)
+            entries.append(value)
+        self._entries = entries
+        self._holes = []
+        for family, (keys, slots) in list(self.families.items()):
+            kept = [(k, moved[s]) for k, s in zip(keys, slots)
+                    if s in moved]
+            if kept:
+                self.families[family] = ([k for k, _ in kept],
+                                         [s for _, s in kept])
+            else:
+                del self.families[family]
+
+    # lookups
+    def range(self, lower=None, upper=None, include_lower=False,
+              include_upper=False):
+        """ positions of items where lower < item[field] < upper
+
+        Arguments:
+            lower: lower bound, None for no bound
+            upper: upper bound, None for no bound
+            include_lower (bool): use <= for the lower bound
+            include_upper (bool): use <= for the upper bound
+
+        Returns:
+            list: sorted positions, None if the index can not answer
+        """
+        families = {_family(v) for v in (lower, upper) if v is not None}
+        if len(families) != 1 or None in families:
+            return None
+        family = families.pop()
+        if self.unsorted or set(self.families) - {family}:
+            # comparisons would raise TypeError, let the caller do it
+            return None
+        if family not in self.families:
+            return []
+        keys, slots = self.families[family]
+        start, end = 0, len(keys)
+        if lower is not None:
+            if include_lower:
+                start = bisect_left(keys, lower)
+            else:
+                start = bisect_right(keys, lower)
+        if upper is not None:
+            if include_upper:
+                end = bisect_right(keys, upper)
+            else:
+                end = bisect_left(keys, upper)
+        return sorted(self._positions(slots[start:end]))
+
+
+class ContentIndex(_SlotIndex):
+    """ maps the hash of whole items to their positions
+
+    used for exact item matches (item in db, add_item, get_item_id), items
+    that can not be hashed all share the None bucket, lookups return
+    candidates that must be compared with == by the caller
+    """
+    _EMPTY = _MISSING
+
+    def __init__(self):
+        super().__init__()
+        self.buckets = {}   # item hash -> slots
+
+    @staticmethod
+    def _hash(item):
+        try:
+            return hash(freeze(item))
+        except TypeError:
+            return None
+
+    def _entry(self, item):
+        return self._hash(item)
+
+    def _add(self, pos, h):
+        if h is not _MISSING:
+            self.buckets.setdefault(h, []).append(pos)
+
+    def _discard(self, pos, h):
+        if h is _MISSING:
+            return
+        bucket = self.buckets[h]
+        bucket.remove(pos)
+        if not bucket:
+            del self.buckets[h]
+
+    # maintenance
+    def _reindex(self, hashes):
+        self.buckets = {}
+        self._entries = hashes
+        self._holes = []
+        for pos, h in enumerate(hashes):
+            self._add(pos, h)
+
+    def rebuild(self, items):
+        self._reindex([self._hash(item) for item in items])
+
+    def append(self, item):
+        h = self._hash(item)
+        self._entries.append(h)
+        self._add(len(self._entries) - 1, h)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    # lookups
+    def lookup(self, item):
+        """ sorted positions of items that may be equal to item """
+        return self.lookup_hash(self._hash(item))
+
+    def lookup_hash(self, h):
+        """ sorted positions of items whose _hash() is h """
+        return sorted(self._positions(self.buckets.get(h, ())))
+
+
+def _fuzzy_strings(item, field):
+    """ strings fuzzy searches compare against, and if some values need the
+    item to be checked anyway
+
+    Returns:
+        tuple: (strings compared by get_value_recursively_fuzzy,
+                strings compared by Query.contains_value(fuzzy=True),
+                True if some compared value is not a string)
+    """
+    nested, top, scan = [], [], False
+    stack = [item]
+    while stack:
+        d = stack.pop()
+        for key, value in d.items():
+            if key == field:
+                if isinstance(value, str):
+                    nested.append(value)
+                elif isinstance(value, list):
+                    for v in value:
+                        if isinstance(v, str):
+                            nested.append(v)
+                        else:
+                            scan = True
+            elif isinstance(value, dict):
+                stack.append(value)
+            elif isinstance(value, list):
+                for v in value:
+                    if isinstance(v, dict):
+                        stack.append(v)
+                    elif hasattr(v, "__dict__"):
+                        scan = True
+    value = item.get(field)
+    if isinstance(value, str):
+        top.append(value)
+    elif isinstance(value, (list, dict)):
+        for v in value:
+            if isinstance(v, str):
+                top.append(v)
+            else:
+                scan = True
+    return nested, top, scan
+
+
+class _StringTable:
+    """ distinct strings -> positions, grouped by length """
+    def __init__(self):
+        self.positions = {}   # string -> positions
+        self.by_length = {}   # length -> strings
+        self._counts = {}     # string -> character counts
+
+    def add(self, pos, strings):
+        for s in strings:
+            if s not in self.positions:
+                self.positions[s] = set()
+                self.by_length.setdefault(len(s), set()).add(s)
+            self.positions[s].add(pos)
+
+    def discard(self, pos, strings):
+        for s in strings:
+            positions = self.positions[s]
+            positions.discard(pos)
+            if not positions:
+                del self.positions[s]
+                self._counts.pop(s, None)
+                strings_of_len = self.by_length[len(s)]
+                strings_of_len.discard(s)
+                if not strings_of_len:
+                    del self.by_length[len(s)]
+
+    def candidates(self, query, thresh):
+        found = set()
+        counts = Counter(query)
+        for length, strings in self.by_length.items():
+            total = len(query) + length
+            if total and 2.0 * min(len(query), length) / total < thresh:
+                continue  # too short or too long to ever reach thresh
+            for s in strings:
+                if total:
+                    if s not in self._counts:
+                        self._counts[s] = Counter(s)
+                    common = shared_chars(counts, self._counts[s])
+                    if 2.0 * common / total < thresh:
+                        continue
+                found |= self.positions[s]
+        return found
+
+
+class FuzzyIndex(_SlotIndex):
+    """ prunes the items a fuzzy search on a field has to score
+
+    fuzzy_match can not score more than the length of the strings and the
+    characters they have in common allow, strings that can not reach the
+    threshold are skipped without computing the real score, so results are
+    the same as without the index
+
+    Arguments:
+        field (str): key to index
+    """
+    _EMPTY = ((), (), False)
+
+    def __init__(self, field):
+        super().__init__()
+        self.field = field
+        self.nested = _StringTable()  # search_by_value(fuzzy=True)
+        self.top = _StringTable()     # Query.contains_value(fuzzy=True)
+        self.scan = set()             # slots that must always be checked
+
+    def _entry(self, item):
+        if not isinstance(item, dict):
+            return (), (), False
+        nested, top, scan = _fuzzy_strings(item, self.field)
+        return set(nested), set(top), scan
+
+    def _add(self, pos, entry):
+        nested, top, scan = entry
+        self.nested.add(pos, nested)
+        self.top.add(pos, top)
+        if scan:
+            self.scan.add(pos)
+
+    def _discard(self, pos, entry):
+        nested, top, scan = entry
+        self.nested.discard(pos, nested)
+        self.top.discard(pos, top)
+        self.scan.discard(pos)
+
+    def _reindex(self, entries):
+        self.nested = _StringTable()
+        self.top = _StringTable()
+        self.scan = set()
+        self._entries = entries
+        self._holes = []
+        for pos, entry in enumerate(entries):
+            self._add(pos, entry)
+
+    # maintenance
+    def rebuild(self, items):
+        self._reindex([self._entry(item) for item in items])
+
+    def append(self, item):
+        entry = self._entry(item)
+        self._entries.append(entry)
+        self._add(len(self._entries) - 1, entry)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    # lookups
+    def lookup(self, value, thresh, nested=True):
+        """ positions of items that may fuzzy match value
+
+        Arguments:
+            value (str): value to search for
+            thresh (float): minimum score
+            nested (bool): match values at any nesting level like
+                           search_by_value, else only the top level value
+                           like Query.contains_value
+
+        Returns:
+            set: candidate positions, None if value is not a string
+        """
+        if not isinstance(value, str):
+            return None
+        table = self.nested if nested else self.top
+        return self._positions(table.candidates(value, thresh) | self.scan)
+
+
+class TokenIndex(_SlotIndex):
+    """ inverted index of the space separated tokens of a field
+
+    maps every token of item[field] to the positions of the items holding
+    it, with a lower cased variant for case insensitive lookups, list
+    elements and dict keys are indexed as whole tokens like
+    Query.value_contains_token matches them
+
+    Arguments:
+        field (str): top level key to index
+    """
+    _EMPTY = ((), (), (), False)
+
+    def __init__(self, field):
+        super().__init__()
+        self.field = field
+        self.tokens = {}    # token -> slots
+        self.folded = {}    # lower cased token -> slots
+        self.members = {}   # list element / dict key -> slots
+        self.scan = set()   # slots holding values that are not text
+
+    def _entry(self, item):
+        if not isinstance(item, dict) or not item.get(self.field):
+            return (), (), (), False
+        value = item[self.field]
+        if isinstance(value, str):
+            return (set(value.split(" ")), set(value.lower().split(" ")),
+                    (), False)
+        if isinstance(value, (list, dict)):
+            return (), (), {v for v in value if isinstance(v, str)}, False
+        return (), (), (), True
+
+    def _add(self, pos, entry):
+        tokens, folded, members, scan = entry
+        for table, keys in ((self.tokens, tokens), (self.folded, folded),
+                            (self.members, members)):
+            for k in keys:
+                table.setdefault(k, set()).add(pos)
+        if scan:
+            self.scan.add(pos)
+
+    def _discard(self, pos, entry):
+        tokens, folded, members, scan = entry
+        for table, keys in ((self.tokens, tokens), (self.folded, folded),
+                            (self.members, members)):
+            for k in keys:
+                positions = table[k]
+                positions.discard(pos)
+                if not positions:
+                    del table[k]
+        self.scan.discard(pos)
+
+    # maintenance
+    def _reindex(self, entries):
+        self.tokens = {}
+        self.folded = {}
+        self.members = {}
+        self.scan = set()
+        self._entries = entries
+        self._holes = []
+        for pos, entry in enumerate(entries):
+            self._add(pos, entry)
+
+    def rebuild(self, items):
+        self._reindex([self._entry(item) for item in items])
+
+    def append(self, item):
+        entry = self._entry(item)
+        self._entries.append(entry)
+        self._add(len(self._entries) - 1, entry)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    # lookups
+    def lookup(self, token, ignore_case=False):
+        """ positions of items where token is one of the tokens of
+        item[field]
+
+        Returns:
+            set: candidate positions
+        """
+        token = str(token)
+        if ignore_case:
+            found = self.folded.get(token.lower(), set())
+        else:
+            found = self.tokens.get(token, set())
+        return self._positions(found | self.members.get(token, set()) |
+                               self.scan)
+
+    def lookup_all(self, tokens, ignore_case=False):
+        """ positions of items holding every one of tokens """
+        found = None
+        for token in tokens:
+            positions = self.lookup(token, ignore_case)
+            found = positions if found is None else found & positions
+            if not found:
+                break
+        return found
+
+    def lookup_any(self, tokens, ignore_case=False):
+        """ positions of items holding at least one of tokens """
+        found = set()
+        for token in tokens:
+            found |= self.lookup(token, ignore_case)
+        return found
+
+
+INDEX_TYPES = {
+    "hash": HashIndex,
+    "sorted": SortedIndex,
+    "fuzzy": FuzzyIndex,
+    "token": TokenIndex
+}
@@ -0,0 +1,565 @@
+import json
+import mmap
+from bisect import bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import accumulate
+from os import makedirs, remove, replace, getpid, fsync, stat
+from os.path import expanduser, isdir, dirname, isfile, join, basename
+from tempfile import gettempdir
+from threading import get_ident, Lock
+
+from json_database import JsonDatabase, LOG
+from json_database.exceptions import DatabaseNotCommitted
+from json_database.utils.combo_lock import ComboRWLock, DummyLock
+from json_database.utils.undo import UndoLog
+from json_database.utils.watcher import MISSING
+
+
+def _encode(items):
+    return json.dumps(items, ensure_ascii=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+class PagedList(list):
+    """ list of items kept in pages of page_size items
+
+    pages are decoded from the (memory mapped) data file the first time
+    one of their items is accessed, decoded pages are kept in a least
+    recently used cache of cache_size bytes (of encoded page data), pages
+    with changes stay in memory until they are written by the storage
+
+    behaves like a list for the operations JsonDatabase uses, items read
+    from the list must not be modified in place, assign them back instead
+
+    Arguments:
+        page_size (int): max number of items per page
+        cache_size (int): memory budget of the page cache in bytes
+    """
+    def __init__(self, page_size=256, cache_size=32 * 1024 * 1024):
+        super().__init__()
+        self.page_size = page_size
+        self.cache_size = cache_size
+        self.data = None     # mmap of the data file
+        self._pages = []     # [offset, length, count], offset None if new
+        self._starts = []    # position of the first item of every page
+        self._len = 0
+        self._cache = OrderedDict()  # page -> items, clean pages only
+        self._cache_bytes = 0
+        self._dirty = {}     # page -> items, not written yet
+        self.garbage = 0     # bytes of the data file no page points to
+
+    # pages
+    def load_table(self, pages, data):
+        """ use a new page table, drops the cache and unwritten changes """
+        self.data = data
+        self._pages = [list(p) for p in pages]
+        self._len = sum(p[2] for p in self._pages)
+        self._starts = None
+        self._cache.clear()
+        self._cache_bytes = 0
+        self._dirty = {}
+
+    @property
+    def dirty(self):
+        return bool(self._dirty)
+
+    @property
+    def live_bytes(self):
+        return sum(p[1] for p in self._pages)
+
+    def _page(self, page):
+        items = self._dirty.get(page)
+        if items is not None:
+            return items
+        items = self._cache.get(page)
+        if items is not None:
+            self._cache.move_to_end(page)
+            return items
+        offset, length, _ = self._pages[page]
+        items = json.loads(self.data[offset:offset + length])
+        self._cache[page] = items
+        self._cache_bytes += length
+        while self._cache_bytes > self.cache_size and len(self._cache) > 1:
+            evicted, _ = self._cache.popitem(last=False)
+            self._cache_bytes -= self._pages[evicted][1]
+        return items
+
+    def _writable(self, page):
+        """ items of a page, the page will be written on next store """
+        items = self._page(page)
+        if page not in self._dirty:
+            if self._cache.pop(page, None) is not None:
+                self._cache_bytes -= self._pages[page][1]
+            self._dirty[page] = items
+        return items
+
+    def _locate(self, pos):
+        if pos < 0:
+            pos += self._len
+        if not 0 <= pos < self._len:
+            raise IndexError("list index out of range")
+        if self._starts is None:
+            self._starts = [0] + list(accumulate(p[2] for p in self._pages))
+            self._starts.pop()
+        page = bisect_right(self._starts, pos) - 1
+        return page, pos - self._starts[page]
+
+    def write_pages(self, f, offset, rewrite=False):
+        """ write the changed pages to f, the data file, at offset
+
+        Arguments:
+            f (file): data file, positioned at offset
+            offset (int): current size of the data file
+            rewrite (bool): write every page, used to compact the data file
+
+        Returns:
+            int: new size of the data file
+        """
+        # empty pages are dropped, their numbers change
+        keep = [n for n, p in enumerate(self._pages) if p[2]]
+        if len(keep) != len(self._pages):
+            renumber = {old: new for new, old in enumerate(keep)}
+            self.garbage += sum(p[1] for p in self._pages if not p[2])
+            self._pages = [self._pages[n] for n in keep]
+            self._dirty = {renumber[n]: items
+                           for n, items in self._dirty.items()
+                           if n in renumber}
+            self._cache = OrderedDict((renumber[n], items)
+                                      for n, items in self._cache.items()
+                                      if n in renumber)
+            self._cache_bytes = sum(self._pages[n][1] for n in self._cache)
+            self._starts = None
+        for n, page in enumerate(self._pages):
+            if n in self._dirty:
+                data = _encode(self._dirty[n])
+                self.garbage += page[1]
+            elif rewrite:
+                data = self.data[page[0]:page[0] + page[1]]
+            else:
+                continue
+            f.write(data)
+            page[0], page[1] = offset, len(data)
+            offset += len(data)
+        if rewrite:
+            self.garbage = 0
+        # written pages are clean now
+        for n, items in self._dirty.items():
+            self._cache[n] = items
+            self._cache_bytes += self._pages[n][1]
+        self._dirty = {}
+        return offset
+
+    @property
+    def table(self):
+        return [list(p) for p in self._pages]
+
+    # list interface
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return [self[i] for i in range(*pos.indices(self._len))]
+        page, idx = self._locate(pos)
+        return self._page(page)[idx]
+
+    def __setitem__(self, pos, value):
+        if isinstance(pos, slice):
+            raise TypeError("paged lists do not support slice assignment")
+        page, idx = self._locate(pos)
+        self._writable(page)[idx] = value
+
+    def __delitem__(self, pos):
+        self.pop(pos)
+
+    def __iter__(self):
+        for page in range(len(self._pages)):
+            if self._pages[page][2]:
+                yield from self._page(page)
+
+    def __reversed__(self):
+        for page in reversed(range(len(self._pages))):
+            if self._pages[page][2]:
+                yield from reversed(self._page(page))
+
+    def __contains__(self, value):
+        return any(i is value or i == value for i in self)
+
+    def __eq__(self, other):
+        if not isinstance(other, list) or len(self) != len(other):
+            return False
+        return all(a == b for a, b in zip(self, other))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "<PagedList of {} items>".format(self._len)
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def append(self, value):
+        if not self._pages or self._pages[-1][2] >= self.page_size:
+            self._pages.append([None, 0, 0])
+            self._dirty[len(self._pages) - 1] = []
+            if self._starts is not None:
+                self._starts.append(self._len)
+        self._writable(len(self._pages) - 1).append(value)
+        self._pages[-1][2] += 1
+        self._len += 1
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def insert(self, pos, value):
+        if pos >= self._len or not self._pages:
+            self.append(value)
+            return
+        page, idx = self._locate(max(pos, -self._len))
+        self._writable(page).insert(idx, value)
+        self._pages[page][2] += 1
+        self._len += 1
+        self._starts = None
+
+    def pop(self, pos=-1):
+        page, idx = self._locate(pos)
+        value = self._writable(page).pop(idx)
+        self._pages[page][2] -= 1
+        self._len -= 1
+        self._starts = None
+        return value
+
+    def remove(self, value):
+        del self[self.index(value)]
+
+    def index(self, value, *args):
+        for pos, item in enumerate(self):
+            if item == value:
+                return pos
+        raise ValueError("{} is not in list".format(value))
+
+    def count(self, value):
+        return sum(1 for i in self if i == value)
+
+    def clear(self):
+        self.garbage += self.live_bytes
+        self._pages = []
+        self._starts = []
+        self._len = 0
+        self._cache.clear()
+        self._cache_bytes = 0
+        self._dirty = {}
+
+    def copy(self):
+        return list(self)
+
+    def sort(self, *args, **kwargs):
+        raise TypeError("paged lists can not be sorted in place")
+
+    def reverse(self):
+        raise TypeError("paged lists can not be reversed in place")
+
+
+class PagedStorage(dict):
+    """ persistent dict holding one PagedList, the other keys are small
+    values kept in memory
+
+    the file at path is a json page table, items live in a data file next
+    to it (path.<generation>.pages), store() appends the changed pages to
+    the data file and atomically replaces the page table, once more than
+    half of the data file is unused it is rewritten under a new generation
+
+    Arguments:
+        path (str): page table file
+        name (str): key of the PagedList
+        disable_lock (bool): do not lock the file across threads/processes
+        page_size (int): max number of items per page
+        cache_size (int): memory budget for decoded pages, in bytes
+    """
+    # rewrite the data file once it is at least this big and half garbage
+    COMPACT_MIN = 1024 * 1024
+
+    def __init__(self, path, name, disable_lock=False, page_size=256,
+                 cache_size=32 * 1024 * 1024):
+        super().__init__()
+        lock_path = join(gettempdir(), path.split("/")[-1] + ".lock")
+        if disable_lock:
+            LOG.warning("Lock is disabled, database might get corrupted if "
+                        "different processes try to use it at same time!")
+            self.lock = DummyLock(lock_path)
+        else:
+            self.lock = ComboRWLock(lock_path)
+        self._load_lock = Lock()  # loads share self.lock, not self
+        self.path = path
+        self.name = name
+        self.paged = PagedList(page_size, cache_size)
+        dict.__setitem__(self, name, self.paged)
+        self.generation = 0
+        self._end = 0        # size of the data file
+        self._mmap = None
+        self._data_id = None  # (device, inode) of the mapped data file
+        self._changes = 0    # changes to keys other than name
+        self._synced = None  # (changes, page table signature)
+        self._undo = None  # UndoLog of the current transaction
+        if isfile(expanduser(path)):
+            self.load_local(path)
+
+    def _data_path(self, generation=None):
+        if generation is None:
+            generation = self.generation
+        path = expanduser(self.path)
+        return join(dirname(path), "{}.{}.pages".format(basename(path),
+                                                        generation))
+
+    def _signature(self):
+        try:
+            st = stat(expanduser(self.path))
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    @staticmethod
+    def _file_id(path):
+        try:
+            st = stat(path)
+        except OSError:
+            return None
+        return st.st_dev, st.st_ino
+
+    def _stored_generation(self):
+        """ generation of the page table on disk, None if there is none """
+        try:
+            with open(expanduser(self.path), encoding="utf-8") as f:
+                return json.load(f)["generation"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _map(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        data = self._data_path()
+        if isfile(data) and stat(data).st_size:
+            with open(data, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._data_id = self._file_id(data)
+        self._end = stat(data).st_size if isfile(data) else 0
+
+    # JsonStorage interface
+    def _record(self, op, key=None, **kwargs):
+        if key != self.name:
+            self._changes += 1
+
+    def __setitem__(self, key, value):
+        if key == self.name:
+            if value is not self.paged:
+                if self._undo is not None:
+                    self._undo.add(self._put_back, key, list(self.paged))
+                self.paged.clear()
+                self.paged.extend(value)
+            return
+        if self._undo is not None:
+            self._undo.add(self._put_back, key, dict.get(self, key, MISSING))
+        super().__setitem__(key, value)
+        self._changes += 1
+
+    def __delitem__(self, key):
+        if key == self.name:
+            raise KeyError("can not delete the paged items")
+        if self._undo is not None and key in self:
+            self._undo.add(self._put_back, key, dict.get(self, key))
+        super().__delitem__(key)
+        self._changes += 1
+
+    def _put_back(self, key, value):
+        if key == self.name:
+            self.paged.clear()
+            self.paged.extend(value)
+        elif value is MISSING:
+            dict.pop(self, key, None)
+        else:
+            dict.__setitem__(self, key, value)
+
+    @contextmanager
+    def transaction(self, commit=True):
+        """ see JsonStorage.transaction, pages touched by a rolled back
+        transaction are written again by the next store() """
+        outer = self._undo is None
+        if outer:
+            self._undo = UndoLog()
+        self._undo.savepoint((self._changes, self._synced))
+        try:
+            yield self
+        except BaseException:
+            changes, synced = self._undo.rollback()
+            self._changes += 1
+            if self._synced is synced and synced is not None and \
+                    synced[0] == changes:
+                self._synced = (self._changes, synced[1])
+            raise
+        else:
+            self._undo.release()
+        finally:
+            if outer:
+                self._undo = None
+        if outer and commit:
+            self.store()
+
+    def load_local(self, path=None):
+        """ read the page table, pages are only read when accessed """
+        with self.lock.read_lock(), self._load_lock:
+            path = expanduser(path or self.path)
+            signature = self._signature()
+            with open(path, encoding="utf-8") as f:
+                table = json.load(f)
+            for key in list(self):
+                if key != self.name:
+                    dict.__delitem__(self, key)
+            dict.update(self, table.get("meta", {}))
+            self.generation = table["generation"]
+            self.paged.page_size = table.get("page_size",
+                                             self.paged.page_size)
+            self._map()
+            self.paged.load_table(table["pages"], self._mmap)
+            self.paged.garbage = self._end - self.paged.live_bytes
+            self._synced = (self._changes, signature)
+
+    def is_synced(self):
+        return self._synced is not None and not self.paged.dirty and \
+            self._synced == (self._changes, self._signature())
+
+    @property
+    def dirty(self):
+        """ True if memory changed since the last load or store """
+        return self._synced is None or self.paged.dirty or \
+            self._synced[0] != self._changes
+
+    def reload(self, force=False):
+        """ read the page table again, dropping uncommitted changes
+
+        Returns:
+            bool: True if the page table was read
+        """
+        if not isfile(expanduser(self.path)):
+            raise DatabaseNotCommitted
+        if not force and self.is_synced():
+            return False
+        self.load_local()
+        return True
+
+    def store(self, path=None):
+        """ write the changed pages and the page table """
+        if path and expanduser(path) != expanduser(self.path):
+            raise ValueError("paged storage can only be stored to its path")
+        if self.is_synced():
+            return
+        with self.lock:
+            path = expanduser(self.path)
+            if dirname(path) and not isdir(dirname(path)):
+                makedirs(dirname(path))
+            old_generations = ()
+            # another instance may have compacted the data file meanwhile
+            # and removed the one the clean pages point into, they are
+            # still readable from the mmap, appending would lose them
+            moved = self._mmap is not None and \
+                self._file_id(self._data_path()) != self._data_id
+            compact = moved or self._end >= self.COMPACT_MIN and \
+                self.paged.garbage * 2 > self._end
+            if compact:
+                # never reuse the generation of the page table on disk
+                old_generations = {self.generation, self._stored_generation()}
+                old_generations.discard(None)
+                self.generation = max(old_generations) + 1
+                with open(self._data_path(), "wb") as f:
+                    self._end = self.paged.write_pages(f, 0, rewrite=True)
+                    f.flush()
+                    fsync(f.fileno())
+            elif self.paged.dirty or not isfile(self._data_path()):
+                with open(self._data_path(), "ab") as f:
+                    # another process may have appended pages too
+                    self._end = self.paged.write_pages(f, f.tell())
+                    f.flush()
+                    fsync(f.fileno())
+            table = {
+                "generation": self.generation,
+                "page_size": self.paged.page_size,
+                "pages": self.paged.table,
+                "meta": self._meta()
+            }
+            changes = self._changes
+            tmp = "{}.{}.{}.tmp".format(path, getpid(), get_ident())
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(table, f, ensure_ascii=False)
+                    f.flush()
+                    fsync(f.fileno())
+                replace(tmp, path)
+            finally:
+                if isfile(tmp):
+                    remove(tmp)
+            self._map()
+            self.paged.data = self._mmap
+            for generation in old_generations:
+                if isfile(self._data_path(generation)):
+                    remove(self._data_path(generation))
+            self._synced = (changes, self._signature())
+
+    def _meta(self):
+        """ everything but the paged items """
+        return {k: v for k, v in dict.items(self) if k != self.name}
+
+    def flush(self):
+        """ nothing is written in the background """
+
+    def watch(self, callback=None, interval=0.5, use_inotify=True):
+        raise NotImplementedError("paged storage can not be watched")
+
+    def unwatch(self):
+        pass
+
+    def remove(self):
+        with self.lock:
+            for path in (expanduser(self.path), self._data_path()):
+                if isfile(path):
+                    remove(path)
+            self._synced = None
+
+    def __repr__(self):
+        return repr({k: v for k, v in dict.items(self)})
+
+
+class PagedJsonDatabase(JsonDatabase):
+    """ JsonDatabase for collections larger than memory
+
+    items are stored in pages that are only read (memory mapped) and decoded
+    when accessed, a cache of cache_size bytes keeps recently used pages,
+    commit() only writes the pages that changed
+
+    items returned by the database must not be modified in place, use
+    update_item instead
+
+    Arguments:
+        page_size (int): max number of items per page
+        cache_size (int): memory budget for decoded pages, in bytes
+    """
+    # pages are decoded on access, in place changes are not supported
+    _track_items = False
+
+    def __init__(self, name, path=None, disable_lock=False,
+                 extension="jsonpages", stable_ids=False, page_size=256,
+                 cache_size=32 * 1024 * 1024):
+        super().__init__(name, path, disable_lock, extension, stable_ids,
+                         page_size=page_size, cache_size=cache_size)
+
+    def _open_storage(self, disable_lock=False, **kwargs):
+        return PagedStorage(self.path, self.name, disable_lock, **kwargs)
@@ -0,0 +1,161 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from os import cpu_count
+
+import json_database.utils
+
+# items of the database, set once when a worker process starts
+_ITEMS = None
+
+
+def _init_worker(items):
+    global _ITEMS
+    _ITEMS = items
+
+
+def _query_chunk(stages, skip_none, start, stop):
+    """ positions in start:stop of the items passing every filter """
+    from json_database.search import FILTERS
+    checks = [FILTERS[name](**kwargs) for name, kwargs in stages]
+    items = _ITEMS
+    found = []
+    for pos in range(start, stop):
+        item = items[pos]
+        if item is None and skip_none:
+            continue  # tombstone
+        if all(check(item) for check in checks):
+            found.append(pos)
+    return found
+
+
+def _dict_paths(item):
+    """ id of every dict nested in item -> keys / indexes leading to it """
+    paths = {}
+    stack = [(item, ())]
+    while stack:
+        value, path = stack.pop()
+        if isinstance(value, dict):
+            paths[id(value)] = path
+            children = value.items()
+        else:
+            children = enumerate(value)
+        stack.extend((child, path + (k,)) for k, child in children
+                     if isinstance(child, (dict, list)))
+    return paths
+
+
+def _search_chunk(func_name, args, start, stop):
+    """ (position, matches) of the items in start:stop with matches, a
+    match is the path to the matching dict, plus the score if fuzzy """
+    func = getattr(json_database.utils, func_name)
+    items = _ITEMS
+    found = []
+    for pos in range(start, stop):
+        item = items[pos]
+        if not isinstance(item, dict):
+            continue
+        matches = list(func(item, *args))
+        if matches:
+            paths = _dict_paths(item)
+            found.append((pos, [(paths[id(m[0])], m[1])
+                                if isinstance(m, tuple) else (paths[id(m)],)
+                                for m in matches]))
+    return found
+
+
+def _resolve(value, path):
+    for key in path:
+        value = value[key]
+    return value
+
+
+class ProcessSearch:
+    """ runs the filters of a Query and the recursive searches of a
+    JsonDatabase in a pool of worker processes
+
+    the items are shipped to the workers once, when the pool starts, and
+    again only after they changed, every query then only sends its filters
+    and gets back the positions of the matching items (and the paths to
+    the matching dicts for searches), which are handed out in order like
+    the serial search does
+
+    Arguments:
+        workers (int): worker processes, defaults to the number of cpus
+        min_items (int): smaller databases are searched serially
+        mp_context: multiprocessing context of the pool
+    """
+    MIN_ITEMS = 50000
+    # chunks per worker, smaller chunks even out slow and fast chunks
+    CHUNKS = 4
+
+    def __init__(self, workers=None, min_items=None, mp_context=None):
+        self.workers = workers or cpu_count() or 1
+        self.min_items = self.MIN_ITEMS if min_items is None else min_items
+        self.mp_context = mp_context
+        self._pool = None
+        self._version = None
+
+    def _pool_for(self, db):
+        """ pool whose workers hold the current items of db, None if db is
+        too small to be worth it """
+        items = db._items
+        if type(items) is not list or len(items) < self.min_items:
+            return None
+        version = (id(items), len(items), db.db._changes)
+        if self._pool is None or version != self._version:
+            self.close()
+            self._pool = ProcessPoolExecutor(
+                self.workers, mp_context=self.mp_context,
+                initializer=_init_worker, initargs=(items,))
+            self._version = version
+        return self._pool
+
+    def _map(self, pool, func, size):
+        """ func(start, stop) over chunks of size items, results in order """
+        step = max(1, -(-size // (self.workers * self.CHUNKS)))
+        starts = range(0, size, step)
+        stops = [min(start + step, size) for start in starts]
+        found = []
+        for positions in pool.map(func, starts, stops):
+            found += positions
+        return found
+
+    def query(self, db, stages):
+        """ positions of the items passing all the filters of stages
+
+        Returns:
+            list: sorted positions, None if db should be searched serially
+        """
+        pool = self._pool_for(db)
+        if pool is None:
+            return None
+        func = partial(_query_chunk, stages, db.stable_ids)
+        return self._map(pool, func, len(db._items))
+
+    def search(self, db, func, *args):
+        """ func(item, *args) for every item, func is one of the iter_*
+        recursive searches of json_database.utils
+
+        Returns:
+            list: the matches of all the items, in order, they are the
+                  stored (nested) dicts like with the serial search, None
+                  if db should be searched serially
+        """
+        pool = self._pool_for(db)
+        if pool is None:
+            return None
+        func = partial(_search_chunk, func.__name__, args)
+        found = []
+        for pos, matches in self._map(pool, func, len(db._items)):
+            item = db._tracked(pos)
+            for match in matches:
+                value = _resolve(item, match[0])
+                found.append((value, match[1]) if len(match) > 1 else value)
+        return found
+
+    def close(self):
+        """ stop the worker processes """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+            self._version = None
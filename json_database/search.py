@@ -1,169 +1,403 @@
-from json_database.utils import fuzzy_match, match_one
+import operator
+from itertools import chain, islice, compress, count
+from json_database.utils import fuzzy_match, fuzzy_match_bound, match_one
 from json_database import JsonDatabase, JsonStorageXDG
+from json_database.sharded import ShardedJsonDatabase
+
+
+# filters, each returns a predicate deciding if an item is kept
+def _contains_key(key, fuzzy=False, thresh=0.7, ignore_case=False):
+    if fuzzy:
+        def predicate(e):
+            for k in e:
+                if ignore_case:
+                    k, target = k.lower(), key.lower()
+                else:
+                    target = key
+                if fuzzy_match_bound(k, target, thresh) < thresh:
+                    continue
+                if fuzzy_match(k, target) >= thresh:
+                    return True
+            return False
+    elif ignore_case:
+        def predicate(a):
+            return a.get(key) or a.get(key.lower())
+    else:
+        def predicate(a):
+            return a.get(key)
+    return predicate
+
+
+def _with_key(key, ignore_case, check):
+    """ all value filters first require the key to be present """
+    if ignore_case:
+        lower = key.lower()
+
+        def predicate(a):
+            return (a.get(key) or a.get(lower)) and check(a)
+    else:
+        def predicate(a):
+            return a.get(key) and check(a)
+    return predicate
+
+
+def _contains_value(key, value, fuzzy=False, thresh=0.75, ignore_case=False):
+    if fuzzy:
+        def check(e):
+            if isinstance(e[key], str):
+                if ignore_case:
+                    score = fuzzy_match(value.lower(), e[key].lower())
+                else:
+                    score = fuzzy_match(value, e[key])
+                return score > thresh
+            elif isinstance(e[key], list):
+                if ignore_case:
+                    v, score = match_one(value.lower(),
+                                         [_.lower() for _ in e[key]])
+                else:
+                    v, score = match_one(value, e[key])
+                return score >= thresh
+            elif isinstance(e[key], dict):
+                if ignore_case:
+                    v, score = match_one(value.lower(),
+                                         [_.lower() for _ in e[key].keys()])
+                else:
+                    v, score = match_one(value, e[key])
+                return score >= thresh
+            return False
+    elif ignore_case and isinstance(value, str):
+        def check(a):
+            if isinstance(a[key], str) and value.lower() in a[key].lower():
+                return True
+            return value.lower() in a[key] or value in a[key]
+    elif not ignore_case:
+        def predicate(a):
+            return a.get(key) and value in a[key]
+        return predicate
+    else:
+        def check(a):
+            return value in a[key]
+    return _with_key(key, ignore_case, check)
+
+
+def _value_contains(key, value, ignore_case=False):
+    if ignore_case:
+        value = str(value).lower()
+
+        def check(e):
+            if isinstance(e[key], str):
+                return value in e[key].lower()
+            elif isinstance(e[key], list):
+                return value in [str(_).lower() for _ in e[key]]
+            elif isinstance(e[key], dict):
+                return value in [str(_).lower() for _ in e[key].keys()]
+            return False
+    else:
+        def predicate(e):
+            return e.get(key) and value in e[key]
+        return predicate
+    return _with_key(key, ignore_case, check)
+
+
+def _value_contains_token(key, value, fuzzy=False, thresh=0.75,
+                          ignore_case=False):
+    value = str(value)
+
+    def check(e):
+        if isinstance(e[key], str):
+            if fuzzy:
+                _, score = match_one(value.lower(), e[key].lower().split(" "))
+                return score > thresh
+            elif ignore_case and value.lower() in e[key].lower().split(" "):
+                return True
+            return value in e[key].split(" ")
+        return value in e[key]
+    return _with_key(key, ignore_case, check)
+
+
+def _value_contains_tokens(key, tokens, require_all=True, ignore_case=False):
+    tokens = [str(t) for t in tokens]
+    folded = [t.lower() for t in tokens]
+    match = all if require_all else any
+
+    def check(e):
+        if isinstance(e[key], str):
+            if ignore_case:
+                words = set(e[key].lower().split(" "))
+                return match(t in words for t in folded)
+            words = set(e[key].split(" "))
+            return match(t in words for t in tokens)
+        return match(t in e[key] for t in tokens)
+    return _with_key(key, ignore_case, check)
+
+
+def _equal(key, value, ignore_case=False):
+    if not ignore_case:
+        def predicate(a):
+            return a.get(key) and a[key] == value
+        return predicate
+    if isinstance(value, str):
+        def check(a):
+            return a[key].lower() == value.lower()
+    else:
+        def check(a):
+            return a[key] == value
+    return _with_key(key, ignore_case, check)
+
+
+_OPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge
+}
+
+
+def _compare(key, value, op, ignore_case=False):
+    compare = _OPERATORS[op]
+    if not ignore_case:
+        # one closure per operator, this is the hot path of range queries
+        if op == "<":
+            def predicate(a):
+                return a.get(key) and a[key] < value
+        elif op == "<=":
+            def predicate(a):
+                return a.get(key) and a[key] <= value
+        elif op == ">":
+            def predicate(a):
+                return a.get(key) and a[key] > value
+        else:
+            def predicate(a):
+                return a.get(key) and a[key] >= value
+        return predicate
+
+    def check(a):
+        return compare(a[key], value)
+    return _with_key(key, ignore_case, check)
+
+
+def _in_range(key, min_value, max_value, ignore_case=False,
+              include_min=False, include_max=False):
+    def check(a):
+        if include_min:
+            if not min_value <= a[key]:
+                return False
+        elif not min_value < a[key]:
+            return False
+        if include_max:
+            return a[key] <= max_value
+        return a[key] < max_value
+    return _with_key(key, ignore_case, check)
+
+
+FILTERS = {
+    "contains_key": _contains_key,
+    "contains_value": _contains_value,
+    "value_contains": _value_contains,
+    "value_contains_token": _value_contains_token,
+    "value_contains_tokens": _value_contains_tokens,
+    "equal": _equal,
+    "compare": _compare,
+    "in_range": _in_range
+}
+
+
+def _plan(db, name, kwargs):
+    """ positions of the items of db that may pass a filter, from an index
+
+    Returns:
+        iterable: candidate positions, None if no index can be used
+    """
+    key = kwargs.get("key")
+    if name in ("value_contains_token", "value_contains_tokens") and \
+            not kwargs.get("fuzzy"):
+        index = db.get_index(key, "token")
+        ignore_case = kwargs["ignore_case"]
+        if index is None or (ignore_case and key != key.lower()):
+            # ignore_case also accepts items with key.lower()
+            return None
+        if name == "value_contains_token":
+            return index.lookup(kwargs["value"], ignore_case)
+        if kwargs["require_all"]:
+            return index.lookup_all(kwargs["tokens"], ignore_case)
+        return index.lookup_any(kwargs["tokens"], ignore_case)
+    if kwargs.get("ignore_case"):
+        return None
+    if kwargs.get("fuzzy"):
+        index = db.get_index(key, "fuzzy")
+        if index is None or name != "contains_value":
+            return None
+        return index.lookup(kwargs["value"], kwargs["thresh"], nested=False)
+    if name == "equal" or name == "contains_value":
+        index = db.get_index(key, "hash")
+        if index is None:
+            return None
+        if name == "equal":
+            return index.lookup(kwargs["value"])
+        return index.lookup_member(kwargs["value"])
+    if name == "compare":
+        index = db.get_index(key, "sorted")
+        value, op = kwargs["value"], kwargs["op"]
+        if index is None or value is None:
+            return None
+        if op.startswith("<"):
+            return index.range(upper=value, include_upper=op == "<=")
+        return index.range(lower=value, include_lower=op == ">=")
+    if name == "in_range":
+        index = db.get_index(key, "sorted")
+        if index is None or kwargs["min_value"] is None or \
+                kwargs["max_value"] is None:
+            return None
+        return index.range(kwargs["min_value"], kwargs["max_value"],
+                           kwargs["include_min"], kwargs["include_max"])
+    return None
 
 
 class Query:
+    """ chain filters over the items of a database
+
+    filters are only recorded, the items are checked against all of them
+    in a single pass when the query is iterated or build() is called, if the
+    database has an index for one of the filters only its candidates are
+    checked
+    """
     def __init__(self, db):
-        if isinstance(db, JsonDatabase):
-            self.result = list(db)
+        self.db = db
+        self.stages = []  # (filter name, filter kwargs)
+        self._limit = None
+
+    def _filter(self, name, **kwargs):
+        self.stages.append((name, kwargs))
+        return self
+
+    def _source(self, db=None):
+        db = db if db is not None else self.db
+        if isinstance(db, ShardedJsonDatabase):
+            # fan out, every shard uses its own indexes
+            return chain.from_iterable(self._source(shard)
+                                       for shard in db.shards)
+        if not isinstance(db, JsonDatabase):
+            return self._filter_items([db])
+        items = db._items
+        checks = [FILTERS[name](**kwargs) for name, kwargs in self.stages]
+        for name, kwargs in self.stages:
+            positions = _plan(db, name, kwargs)
+            if positions is not None:
+                positions = sorted(positions)
+                break
         else:
-            self.result = [db]
+            if db.parallel is not None and checks:
+                positions = db.parallel.query(db, self.stages)
+                if positions is not None:
+                    return map(db._tracked, positions)
+            if db.stable_ids:
+                positions = (pos for pos, item_id in
+                             enumerate(db._ids)
+                             if item_id is not None)
+            elif checks:
+                # positions of the items passing the first filter, without
+                # a python call per item
+                positions = compress(count(), map(checks.pop(0), items))
+            else:
+                positions = range(len(items))
+        # filter the stored items, only the results are handed out tracked
+        for check in checks:
+            positions = filter(lambda pos, check=check: check(items[pos]),
+                               positions)
+        return map(db._tracked, positions)
+
+    def _filter_items(self, items):
+        for name, kwargs in self.stages:
+            items = filter(FILTERS[name](**kwargs), items)
+        return items
 
+    def __iter__(self):
+        # lazily chained filters, every item goes through all the stages
+        # before the next one is read
+        results = self._source()
+        if self._limit is not None:
+            results = islice(results, max(self._limit, 0))
+        return iter(results)
+
+    # filters
     def contains_key(self, key, fuzzy=False, thresh=0.7, ignore_case=False):
-        if fuzzy:
-            after = []
-            for e in self.result:
-                filter = True
-                for k in e:
-                    if ignore_case:
-                        score = fuzzy_match(k.lower(), key.lower())
-                    else:
-                        score = fuzzy_match(k, key)
-                    if score < thresh:
-                        continue
-                    filter = False
-                if not filter:
-                    after.append(e)
-            self.result = after
-        elif ignore_case:
-            self.result = [a for a in self.result
-                           if a.get(key) or a.get(key.lower())]
-        else:
-            self.result = [a for a in self.result if a.get(key)]
-        return self
+        return self._filter("contains_key", key=key, fuzzy=fuzzy,
+                            thresh=thresh, ignore_case=ignore_case)
 
     def contains_value(self, key, value, fuzzy=False, thresh=0.75, ignore_case=False):
-        self.contains_key(key, ignore_case=ignore_case)
-        if fuzzy:
-            after = []
-            for e in self.result:
-                if isinstance(e[key], str):
-                    if ignore_case:
-                        score = fuzzy_match(value.lower(), e[key].lower())
-                    else:
-                        score = fuzzy_match(value, e[key])
-                    if score > thresh:
-                        after.append(e)
-                elif isinstance(e[key], list):
-                    if ignore_case:
-                        v, score = match_one(value.lower(),
-                                             [_.lower() for _ in e[key]])
-                    else:
-                        v, score = match_one(value, e[key])
-                    if score < thresh:
-                        continue
-                    after.append(e)
-                elif isinstance(e[key], dict):
-                    if ignore_case:
-                        v, score = match_one(value.lower(),
-                                             [_.lower() for _ in e[key].keys()])
-                    else:
-                        v, score = match_one(value, e[key])
-                    if score < thresh:
-                        continue
-                    after.append(e)
-            self.result = after
-        elif ignore_case and isinstance(value, str):
-            after = []
-            for a in self.result:
-                if isinstance(a[key], str) and value.lower() in a[key].lower():
-                    after.append(a)
-                elif value.lower() in a[key] or value in a[key]:
-                    after.append(a)
-            self.result = after
-        else:
-            self.result = [a for a in self.result if value in a[key]]
-        return self
+        return self._filter("contains_value", key=key, value=value,
+                            fuzzy=fuzzy, thresh=thresh,
+                            ignore_case=ignore_case)
 
     def value_contains(self, key, value, ignore_case=False):
-        self.contains_key(key, ignore_case=ignore_case)
-        if ignore_case:
-            after = []
-            value = str(value).lower()
-            for e in self.result:
-                if isinstance(e[key], str) and ignore_case:
-                    if value.lower() in e[key].lower():
-                        after.append(e)
-                elif isinstance(e[key], list) and ignore_case:
-                    if value.lower() in [str(_).lower() for _ in e[key]]:
-                        after.append(e)
-                elif isinstance(e[key], dict) and ignore_case:
-                    if value.lower() in [str(_).lower() for _ in e[key].keys()]:
-                        after.append(e)
-
-                elif isinstance(e[key], str):
-                    if value in e[key]:
-                        after.append(e)
-                elif isinstance(e[key], list):
-                    if value in [str(_) for _ in e[key]]:
-                        after.append(e)
-                elif isinstance(e[key], dict):
-                    if value in [str(_) for _ in e[key].keys()]:
-                        after.append(e)
-
-            self.result = after
-        else:
-            self.result = [e for e in self.result if value in e[key]]
-        return self
+        return self._filter("value_contains", key=key, value=value,
+                            ignore_case=ignore_case)
 
     def value_contains_token(self, key, value, fuzzy=False, thresh=0.75, ignore_case=False):
-        self.contains_key(key, ignore_case=ignore_case)
-        after = []
-        value = str(value)
-        for e in self.result:
-            if isinstance(e[key], str):
-                if fuzzy:
-                    _, score = match_one(value.lower(),
-                                         e[key].lower().split(" "))
-                    if score > thresh:
-                        after.append(e)
-                elif ignore_case and value.lower() in e[key].lower().split(" "):
-                    after.append(e)
-                elif value in e[key].split(" "):
-                    after.append(e)
-            elif value in e[key]:
-                after.append(e)
-        self.result = after
-        return self
+        return self._filter("value_contains_token", key=key, value=value,
+                            fuzzy=fuzzy, thresh=thresh,
+                            ignore_case=ignore_case)
+
+    def value_contains_tokens(self, key, tokens, require_all=True,
+                              ignore_case=False):
+        """ items where all (or with require_all=False any) of tokens are
+        tokens of item[key] """
+        return self._filter("value_contains_tokens", key=key,
+                            tokens=list(tokens), require_all=require_all,
+                            ignore_case=ignore_case)
 
     def equal(self, key, value, ignore_case=False):
-        self.contains_key(key, ignore_case=ignore_case)
-        if ignore_case and isinstance(value, str):
-            self.result = [a for a in self.result
-                           if a[key].lower() == value.lower()]
-        else:
-            self.result = [a for a in self.result if a[key] == value]
-        return self
+        return self._filter("equal", key=key, value=value,
+                            ignore_case=ignore_case)
 
     def bellow(self, key, value, ignore_case=False):
-        self.contains_key(key, ignore_case=ignore_case)
-        self.result = [a for a in self.result if a[key] < value]
-        return self
+        return self._filter("compare", key=key, value=value, op="<",
+                            ignore_case=ignore_case)
 
     def above(self, key, value, ignore_case=False):
-        self.contains_key(key, ignore_case=ignore_case)
-        self.result = [a for a in self.result if a[key] > value]
-        return self
+        return self._filter("compare", key=key, value=value, op=">",
+                            ignore_case=ignore_case)
 
     def bellow_or_equal(self, key, value, ignore_case=False):
-        self.contains_key(key, ignore_case=ignore_case)
-        self.result = [a for a in self.result if a[key] <= value]
-        return self
+        return self._filter("compare", key=key, value=value, op="<=",
+                            ignore_case=ignore_case)
 
     def above_or_equal(self, key, value, ignore_case=False):
-        self.contains_key(key, ignore_case=ignore_case)
-        self.result = [a for a in self.result if a[key] >= value]
-        return self
+        return self._filter("compare", key=key, value=value, op=">=",
+                            ignore_case=ignore_case)
 
-    def in_range(self, key, min_value, max_value, ignore_case=False):
-        self.contains_key(key, ignore_case=ignore_case)
-        self.result = [a for a in self.result if min_value < a[key] < max_value]
-        return self
+    def in_range(self, key, min_value, max_value, ignore_case=False,
+                 include_min=False, include_max=False):
+        return self._filter("in_range", key=key, min_value=min_value,
+                            max_value=max_value, ignore_case=ignore_case,
+                            include_min=include_min, include_max=include_max)
 
     def all(self):
         return self
 
+    def limit(self, n):
+        """ stop after n results """
+        self._limit = n
+        return self
+
+    # results
     def build(self):
-        return self.result
+        return list(self)
+
+    @property
+    def result(self):
+        return self.build()
+
+    def first(self):
+        """ first result, None if nothing matches """
+        for e in self:
+            return e
+        return None
 
+    def count(self):
+        return sum(1 for _ in self)
 
+    def exists(self):
+        for _ in self:
+            return True
+        return False
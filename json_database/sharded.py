@@ -0,0 +1,294 @@
+import json
+from bisect import bisect_right
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+from os.path import expanduser
+from zlib import crc32
+
+from json_database import JsonDatabase, JsonStorage
+from json_database.exceptions import InvalidItemID
+from json_database.utils import jsonify_recursively, first_matches, \
+    best_matches
+
+
+class ShardedJsonDatabase:
+    """ JsonDatabase split across several files
+
+    items are assigned to a shard when added, by a hash of item[shard_key]
+    (of the whole item if no shard_key) or, with partition="range", by
+    comparing item[shard_key] with the sorted boundaries in ranges, shard i
+    holds the values bellow ranges[i]
+
+    shards are loaded and committed in parallel by a pool of workers, each
+    shard has its own lock and commit() only writes shards that changed,
+    decompression and file io run in parallel, json decoding itself does
+    not
+
+    by default item ids are the position of the item in the concatenation
+    of the shards, with stable_ids every shard has stable ids and the item
+    id is shard_item_id * number of shards + shard
+
+    Arguments:
+        name (str): name of the collection
+        path (str): base path, shard i is stored in {path}.{i}.{extension}
+        shards (int): number of shards, len(ranges) + 1 with range
+                      partitioning
+        shard_key (str): key used to assign items to shards
+        partition (str): "hash" or "range"
+        ranges (list): shard boundaries for range partitioning
+        workers (int): threads used to load / commit the shards
+
+    extra keyword arguments are passed to every shard JsonDatabase, the
+    sharding settings are saved in {path}.shards.{extension} and must not
+    change once the database has items
+    """
+    def __init__(self, name, path=None, shards=4, shard_key=None,
+                 partition="hash", ranges=None, disable_lock=False,
+                 extension="json", stable_ids=False, workers=None,
+                 **kwargs):
+        self.name = name
+        self.path = path or name
+        self.extension = extension
+        self.stable_ids = stable_ids
+        self.workers = workers
+        self.settings = settings = JsonStorage(
+            expanduser(f"{self.path}.shards.{extension}"),
+            disable_lock=disable_lock)
+        if settings:
+            # existing database, items were assigned with these settings
+            shards = settings["shards"]
+            shard_key = settings["shard_key"]
+            partition = settings["partition"]
+            ranges = settings["ranges"]
+        if partition not in ("hash", "range"):
+            raise ValueError("unknown partition: " + str(partition))
+        if partition == "range":
+            if shard_key is None or not ranges:
+                raise ValueError("range partitioning needs a shard_key "
+                                 "and ranges")
+            ranges = sorted(ranges)
+            shards = len(ranges) + 1
+        self.shard_key = shard_key
+        self.partition = partition
+        self.ranges = ranges
+        if not settings:
+            settings.update({"shards": shards, "shard_key": shard_key,
+                             "partition": partition, "ranges": ranges})
+            settings.store()
+
+        def load(i):
+            return JsonDatabase(name, self._shard_path(i), disable_lock,
+                                extension, stable_ids, **kwargs)
+
+        self.shards = self._map(load, range(shards))
+
+    def _shard_path(self, i):
+        return f"{self.path}.{i}.{self.extension}"
+
+    def _map(self, func, args):
+        """ call func for every arg in parallel, returns the results """
+        args = list(args)
+        if len(args) < 2 or self.workers == 1:
+            return [func(a) for a in args]
+        with ThreadPoolExecutor(self.workers) as pool:
+            return list(pool.map(func, args))
+
+    # sharding
+    def shard_for(self, item):
+        """ number of the shard item belongs to """
+        if isinstance(item, dict) and self.shard_key is not None:
+            value = item.get(self.shard_key)
+        else:
+            value = item
+        if self.partition == "range":
+            try:
+                return bisect_right(self.ranges, value)
+            except TypeError:
+                # missing or not comparable to the boundaries
+                return 0
+        key = json.dumps(value, sort_keys=True, default=str)
+        return crc32(key.encode("utf-8")) % len(self.shards)
+
+    def _locate(self, item_id):
+        """ (shard, item id inside the shard) of a database item id """
+        if not isinstance(item_id, int):
+            raise InvalidItemID
+        if self.stable_ids:
+            return self.shards[item_id % len(self.shards)], \
+                item_id // len(self.shards)
+        if item_id < 0:
+            item_id += len(self)
+        for shard in self.shards:
+            if 0 <= item_id < len(shard):
+                return shard, item_id
+            item_id -= len(shard)
+        raise InvalidItemID
+
+    def _global_id(self, shard_no, item_id):
+        if self.stable_ids:
+            return item_id * len(self.shards) + shard_no
+        return sum(len(s) for s in self.shards[:shard_no]) + item_id
+
+    # operator overloads
+    def __enter__(self):
+        """ Context handler """
+        return self
+
+    def __exit__(self, _type, value, traceback):
+        """ Commits changes and Closes the session """
+        self.commit()
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def __iter__(self):
+        for shard in self.shards:
+            yield from shard
+
+    def __getitem__(self, item_id):
+        shard, item_id = self._locate(item_id)
+        return shard[item_id]
+
+    def __setitem__(self, item_id, value):
+        shard, item_id = self._locate(item_id)
+        shard[item_id] = value
+
+    def __contains__(self, item):
+        return any(item in shard for shard in self.shards)
+
+    def __repr__(self):
+        return str(jsonify_recursively(list(self)))
+
+    # database
+    def commit(self):
+        """ store the shards that changed, in parallel """
+        changed = [shard for shard in self.shards
+                   if not shard.db.is_synced()]
+        self._map(lambda shard: shard.commit(), changed)
+
+    def reset(self, force=False):
+        """ discard uncommitted changes, only shards that changed are read
+
+        Returns:
+            bool: True if any shard was read
+        """
+        return any(self._map(lambda shard: shard.reset(force),
+                             self.shards))
+
+    def remove(self):
+        """ delete the files of every shard """
+        for shard in self.shards:
+            shard.db.remove()
+        self.settings.remove()
+
+    # indexes
+    def create_index(self, field, index_type="hash"):
+        for shard in self.shards:
+            shard.create_index(field, index_type)
+
+    def drop_index(self, field, index_type=None):
+        for shard in self.shards:
+            shard.drop_index(field, index_type)
+
+    def rebuild_indexes(self):
+        for shard in self.shards:
+            shard.rebuild_indexes()
+
+    # item manipulations
+    def append(self, value):
+        """ add an item to its shard, returns the new item_id with
+        stable_ids or the number of items otherwise """
+        value = jsonify_recursively(value)
+        shard_no = self.shard_for(value)
+        item_id = self.shards[shard_no].append(value)
+        if self.stable_ids:
+            return self._global_id(shard_no, item_id)
+        return len(self)
+
+    def add_item(self, value, allow_duplicates=False):
+        if allow_duplicates or value not in self:
+            return self.append(value)
+        return self.get_item_id(value)
+
+    def _add_per_shard(self, values, add):
+        """ add(shard, values) for the values of every shard, returns the
+        item ids in the order of values """
+        values = [jsonify_recursively(value) for value in values]
+        groups = {}
+        for pos, value in enumerate(values):
+            groups.setdefault(self.shard_for(value), []).append(pos)
+        added = {shard_no: add(self.shards[shard_no],
+                               [values[pos] for pos in positions])
+                 for shard_no, positions in groups.items()}
+        # without stable_ids global ids depend on the final shard sizes
+        item_ids = [None] * len(values)
+        for shard_no, positions in groups.items():
+            for pos, item_id in zip(positions, added[shard_no]):
+                item_ids[pos] = self._global_id(shard_no, item_id)
+        return item_ids
+
+    def extend(self, values):
+        """ add many items, see JsonDatabase.extend """
+        return self._add_per_shard(values,
+                                   lambda shard, vals: shard.extend(vals))
+
+    def add_items(self, values, allow_duplicates=False):
+        """ add many items, see JsonDatabase.add_items, equal items always
+        belong to the same shard """
+        return self._add_per_shard(
+            values, lambda shard, vals: shard.add_items(vals,
+                                                        allow_duplicates))
+
+    def update_where(self, predicate, patch):
+        """ see JsonDatabase.update_where, items stay in their shard """
+        updated = []
+        for shard_no, shard in enumerate(self.shards):
+            for item_id in shard.update_where(predicate, patch):
+                updated.append(self._global_id(shard_no, item_id))
+        return updated
+
+    def remove_where(self, predicate):
+        removed = []
+        for shard in self.shards:
+            removed += shard.remove_where(predicate)
+        return removed
+
+    def match_item(self, value, match_strategy=None):
+        matches = []
+        for shard_no, shard in enumerate(self.shards):
+            for item, item_id in shard.match_item(value, match_strategy):
+                matches.append((item, self._global_id(shard_no, item_id)))
+        return matches
+
+    def get_item_id(self, item):
+        for match, item_id in self.match_item(item):
+            return item_id
+        return -1
+
+    def update_item(self, item_id, new_item):
+        """ the item stays in its shard even if its shard_key changes """
+        shard, item_id = self._locate(item_id)
+        shard.update_item(item_id, new_item)
+
+    def remove_item(self, item_id):
+        shard, item_id = self._locate(item_id)
+        return shard.remove_item(item_id)
+
+    # search
+    def search_by_key(self, key, fuzzy=False, thresh=0.7,
+                      include_empty=False, limit=None):
+        found = chain.from_iterable(
+            shard.search_by_key(key, fuzzy, thresh, include_empty, limit)
+            for shard in self.shards)
+        if fuzzy:
+            return best_matches(found, limit)
+        return first_matches(found, limit)
+
+    def search_by_value(self, key, value, fuzzy=False, thresh=0.7,
+                        limit=None):
+        found = chain.from_iterable(
+            shard.search_by_value(key, value, fuzzy, thresh, limit)
+            for shard in self.shards)
+        if fuzzy:
+            return best_matches(found, limit)
+        return first_matches(found, limit)
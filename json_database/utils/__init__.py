@@ -1,16 +1,139 @@
 import json
+from collections import Counter, OrderedDict
 from difflib import SequenceMatcher
+from heapq import nlargest
+from itertools import islice
+from operator import itemgetter
+from threading import Lock
+from json_database.utils.stream import load_json_stream, iter_json_items
+
+
+class FuzzyCache:
+    """ least recently used cache of fuzzy_match scores
+
+    Arguments:
+        capacity (int): max number of scores kept, 0 disables the cache
+    """
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._scores = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._scores)
+
+    def peek(self, x, against):
+        """ cached fuzzy_match(x, against) or None, never computes a score
+        and is not counted in the statistics """
+        with self._lock:
+            return self._scores.get((x, against))
+
+    def score(self, x, against):
+        """ fuzzy_match(x, against), computed at most once while cached """
+        key = (x, against)
+        with self._lock:
+            score = self._scores.get(key)
+            if score is not None:
+                self._scores.move_to_end(key)
+                self.hits += 1
+                return score
+            self.misses += 1
+        score = SequenceMatcher(None, x, against).ratio()
+        if self.capacity > 0:
+            with self._lock:
+                self._scores[key] = score
+                while len(self._scores) > self.capacity:
+                    self._scores.popitem(last=False)
+        return score
+
+    def clear(self):
+        """ drop all cached scores and reset the statistics """
+        with self._lock:
+            self._scores.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def resize(self, capacity):
+        with self._lock:
+            self.capacity = capacity
+            while len(self._scores) > max(capacity, 0):
+                self._scores.popitem(last=False)
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self._scores), "capacity": self.capacity}
+
+
+FUZZY_CACHE = FuzzyCache()
 
 
 def fuzzy_match(x, against):
     """Perform a 'fuzzy' comparison between two strings.
+
+    scores of strings are cached in FUZZY_CACHE
+
     Returns:
         float: match percentage -- 1.0 for perfect match,
                down to 0.0 for no match at all.
     """
+    if isinstance(x, str) and isinstance(against, str):
+        return FUZZY_CACHE.score(x, against)
     return SequenceMatcher(None, x, against).ratio()
 
 
+def fuzzy_match_bound(x, against, thresh=0.0, counts=None):
+    """Cheap upper bound of fuzzy_match(x, against).
+
+    fuzzy_match can only pair equal characters, so it can never score more
+    than the length of the strings and the characters they share allow
+    (this is SequenceMatcher.real_quick_ratio and quick_ratio), used to
+    skip the expensive comparison when it can not reach a threshold
+
+    Args:
+        x (str): string to compare
+        against (str): string to compare with
+        thresh (float): only compare shared characters if the length based
+                        bound is not already bellow this
+        counts (Counter): Counter(x), reused when x is compared with many
+                          strings
+
+    Returns:
+        float: score fuzzy_match can not exceed, 1.0 if x or against is
+               not a string, the exact score if it is in FUZZY_CACHE
+    """
+    if not isinstance(x, str) or not isinstance(against, str):
+        return 1.0
+    score = FUZZY_CACHE.peek(x, against)
+    if score is not None:
+        return score
+    total = len(x) + len(against)
+    if not total:
+        return 1.0
+    bound = 2.0 * min(len(x), len(against)) / total
+    if bound < thresh:
+        return bound
+    if counts is None:
+        counts = Counter(x)
+    return 2.0 * shared_chars(counts, against) / total
+
+
+def shared_chars(counts, against):
+    """ number of characters a string with these character counts has in
+    common with against """
+    common = 0
+    # str.count scans against once per distinct character without building
+    # a Counter for it, cheaper for the short strings compared here
+    count = against.count if isinstance(against, str) else against.get
+    for char, n in counts.items():
+        m = count(char)
+        if m:
+            common += n if n < m else m
+    return common
+
+
 def match_one(query, choices):
     """
         Find best match from a list or dictionary given an input
@@ -29,7 +152,10 @@ def match_one(query, choices):
         raise ValueError('a list or dict of choices must be provided')
 
     best = (_choices[0], fuzzy_match(query, _choices[0]))
+    counts = Counter(query) if isinstance(query, str) else None
     for c in _choices[1:]:
+        if fuzzy_match_bound(query, c, best[1], counts) <= best[1]:
+            continue  # can not beat the current best
         score = fuzzy_match(query, c)
         if score > best[1]:
             best = (c, score)
@@ -92,9 +218,7 @@ def load_commented_json(filename):
         obj: decoded Python object
     """
     with open(filename, encoding='utf-8') as f:
-        contents = f.read()
-
-    return json.loads(uncomment_json(contents))
+        return load_json_stream(f)
 
 
 def uncomment_json(commented_json_str):
@@ -146,143 +270,267 @@ def is_jsonifiable(thing):
     return True
 
 
-def get_key_recursively(search_dict, field, filter_None=True):
+# recursive searches, depth first with an explicit stack so deep documents
+# can not hit the recursion limit, the iter_* generators yield matches in
+# document order as they are found, the get_* functions collect them
+def _attributes_match(search, item, *args):
+    """ matches of search in the attributes of a list element that is not
+    a dict (an object), empty if it has none / can not be parsed """
+    attributes = getattr(item, "__dict__", None)
+    if attributes is None:
+        return []
+    try:
+        return list(search(attributes, *args))
+    except Exception:
+        return []  # can't parse
+
+
+def iter_key_recursively(search_dict, field, filter_None=True):
     """
-    Takes a dict with nested lists and dicts,
-    and searches all dicts for a key of the field
-    provided.
+    Generator version of get_key_recursively, yields the dicts that
+    have a key equal to field as they are found
     """
     if not is_jsonifiable(search_dict):
         raise ValueError("unparseable format")
-    fields_found = []
-
-    for key, value in search_dict.items():
-        if value is None and filter_None:
+    # frames: (dict, its items) or (None, elements of a list)
+    stack = [(search_dict, iter(search_dict.items()))]
+    while stack:
+        parent, entries = stack[-1]
+        if parent is None:
+            for item in entries:
+                if isinstance(item, dict):
+                    stack.append((item, iter(item.items())))
+                    break
+                if _attributes_match(iter_key_recursively, item, field,
+                                     filter_None):
+                    yield item
+            else:
+                stack.pop()
             continue
-        if key == field:
-            fields_found.append(search_dict)
+        for key, value in entries:
+            if value is None and filter_None:
+                continue
+            if key == field:
+                yield parent
+            elif isinstance(value, dict):
+                stack.append((value, iter(value.items())))
+                break
+            elif isinstance(value, list):
+                stack.append((None, iter(value)))
+                break
+        else:
+            stack.pop()
 
-        elif isinstance(value, dict):
-            fields_found += get_key_recursively(value, field, filter_None)
 
-        elif isinstance(value, list):
-            for item in value:
-                if not isinstance(item, dict):
+def iter_key_recursively_fuzzy(search_dict, field, thresh=0.6,
+                               filter_None=True):
+    """
+    Generator version of get_key_recursively_fuzzy, yields
+    (dict, score) for the dicts with a key similar to field as they are
+    found, not sorted by score
+    """
+    if not is_jsonifiable(search_dict):
+        raise ValueError("unparseable format")
+    # frames: (dict, its items) or (None, elements of a list, list key)
+    stack = [(search_dict, iter(search_dict.items()), None)]
+    while stack:
+        parent, entries, list_key = stack[-1]
+        if parent is None:
+            for item in entries:
+                if isinstance(item, dict):
+                    stack.append((item, iter(item.items()), None))
+                    break
+                if not _attributes_match(iter_key_recursively_fuzzy, item,
+                                         field, thresh, filter_None):
+                    continue
+                # scored by the key holding the list
+                score = 0
+                if isinstance(list_key, str):
                     try:
-                        if get_key_recursively(item.__dict__, field, filter_None):
-                            fields_found.append(item)
-                    except:
+                        score = fuzzy_match(list_key, field)
+                    except Exception:
                         continue  # can't parse
-                else:
-                    fields_found += get_key_recursively(item, field, filter_None)
-
-    return fields_found
+                yield item, score
+            else:
+                stack.pop()
+            continue
+        for key, value in entries:
+            if value is None and filter_None:
+                continue
+            score = 0
+            if isinstance(key, str) and \
+                    fuzzy_match_bound(key, field, thresh) >= thresh:
+                score = fuzzy_match(key, field)
+            if score >= thresh:
+                yield parent, score
+            elif isinstance(value, dict):
+                stack.append((value, iter(value.items()), None))
+                break
+            elif isinstance(value, list):
+                stack.append((None, iter(value), key))
+                break
+        else:
+            stack.pop()
 
 
-def get_key_recursively_fuzzy(search_dict, field, thresh=0.6, filter_None=True):
+def iter_value_recursively(search_dict, field, target_value):
     """
-    Takes a dict with nested lists and dicts,
-    and searches all dicts for a key of the field
-    provided.
+    Generator version of get_value_recursively, yields the dicts where
+    field == target_value as they are found
     """
     if not is_jsonifiable(search_dict):
         raise ValueError("unparseable format")
+    stack = [(search_dict, iter(search_dict.items()))]
+    while stack:
+        parent, entries = stack[-1]
+        if parent is None:
+            for item in entries:
+                if isinstance(item, dict):
+                    stack.append((item, iter(item.items())))
+                    break
+                if _attributes_match(iter_value_recursively, item, field,
+                                     target_value):
+                    yield item
+            else:
+                stack.pop()
+            continue
+        for key, value in entries:
+            if key == field and value == target_value:
+                yield parent
+            elif isinstance(value, dict):
+                stack.append((value, iter(value.items())))
+                break
+            elif isinstance(value, list):
+                stack.append((None, iter(value)))
+                break
+        else:
+            stack.pop()
 
-    fields_found = []
 
-    for key, value in search_dict.items():
-        if value is None and filter_None:
+def iter_value_recursively_fuzzy(search_dict, field, target_value,
+                                 thresh=0.6):
+    """
+    Generator version of get_value_recursively_fuzzy, yields
+    (dict, score) for the dicts where field is similar to target_value as
+    they are found, not sorted by score
+    """
+    if not is_jsonifiable(search_dict):
+        raise ValueError("unparseable format")
+    stack = [(search_dict, iter(search_dict.items()))]
+    while stack:
+        parent, entries = stack[-1]
+        if parent is None:
+            for item in entries:
+                if isinstance(item, dict):
+                    stack.append((item, iter(item.items())))
+                    break
+                found = _attributes_match(iter_value_recursively_fuzzy, item,
+                                          field, target_value, thresh)
+                if found:
+                    yield item, max(score for _, score in found)
+            else:
+                stack.pop()
             continue
-        score = 0
-        if isinstance(key, str):
-            score = fuzzy_match(key, field)
-
-        if score >= thresh:
-            fields_found.append((search_dict, score))
-        elif isinstance(value, dict):
-            fields_found += get_key_recursively_fuzzy(value, field, thresh, filter_None)
-
-        elif isinstance(value, list):
-            for item in value:
-                if not isinstance(item, dict):
-                    try:
-                        if get_key_recursively_fuzzy(item.__dict__, field, thresh, filter_None):
-                            fields_found.append((item, score))
-                    except:
-                        continue  # can't parse
-                else:
-                    fields_found += get_key_recursively_fuzzy(item, field, thresh, filter_None)
-    return sorted(fields_found, key = lambda i: i[1],reverse=True)
+        for key, value in entries:
+            if key == field:
+                if isinstance(value, str):
+                    if fuzzy_match_bound(target_value, value, thresh) < thresh:
+                        continue
+                    score = fuzzy_match(target_value, value)
+                    if score >= thresh:
+                        yield parent, score
+                elif isinstance(value, list):
+                    for item in value:
+                        if fuzzy_match_bound(target_value, item,
+                                             thresh) < thresh:
+                            continue
+                        score = fuzzy_match(target_value, item)
+                        if score >= thresh:
+                            yield parent, score
+            elif isinstance(value, dict):
+                stack.append((value, iter(value.items())))
+                break
+            elif isinstance(value, list):
+                stack.append((None, iter(value)))
+                break
+        else:
+            stack.pop()
+
+
+def first_matches(found, limit=None):
+    """ list of the first limit matches of a search, all if None """
+    if limit is None:
+        return list(found)
+    return list(islice(found, max(limit, 0)))
+
+
+def best_matches(found, limit=None):
+    """ (match, score) pairs of a fuzzy search from best to worst, matches
+    with the same score keep their order, only the limit best ones if
+    given (a heap, instead of sorting them all) """
+    if limit is None:
+        return sorted(found, key=itemgetter(1), reverse=True)
+    return nlargest(max(limit, 0), found, key=itemgetter(1))
 
 
-def get_value_recursively(search_dict, field, target_value):
+def get_key_recursively(search_dict, field, filter_None=True, limit=None):
     """
     Takes a dict with nested lists and dicts,
     and searches all dicts for a key of the field
     provided.
     """
-    if not is_jsonifiable(search_dict):
-        raise ValueError("unparseable format")
-    fields_found = []
-
-    for key, value in search_dict.items():
+    return first_matches(
+        iter_key_recursively(search_dict, field, filter_None), limit)
 
-        if key == field and value == target_value:
-            fields_found.append(search_dict)
 
-        elif isinstance(value, dict):
-            fields_found += get_value_recursively(value, field, target_value)
+def get_key_recursively_fuzzy(search_dict, field, thresh=0.6,
+                              filter_None=True, limit=None):
+    """
+    Takes a dict with nested lists and dicts,
+    and searches all dicts for a key of the field
+    provided.
+    """
+    return best_matches(
+        iter_key_recursively_fuzzy(search_dict, field, thresh, filter_None),
+        limit)
 
-        elif isinstance(value, list):
-            for item in value:
-                if not isinstance(item, dict):
-                    try:
-                        if get_value_recursively(item.__dict__, field, target_value):
-                            fields_found.append(item)
-                    except:
-                        continue  # can't parse
-                else:
-                    fields_found += get_value_recursively(item, field, target_value)
 
-    return fields_found
+def get_value_recursively(search_dict, field, target_value, limit=None):
+    """
+    Takes a dict with nested lists and dicts,
+    and searches all dicts for a key of the field
+    provided.
+    """
+    return first_matches(
+        iter_value_recursively(search_dict, field, target_value), limit)
 
 
-def get_value_recursively_fuzzy(search_dict, field, target_value, thresh=0.6):
+def get_value_recursively_fuzzy(search_dict, field, target_value, thresh=0.6,
+                                limit=None):
     """
     Takes a dict with nested lists and dicts,
     and searches all dicts for a key of the field
     provided.
     """
-    if not is_jsonifiable(search_dict):
-        raise ValueError("unparseable format")
-    fields_found = []
-    for key, value in search_dict.items():
-        if key == field:
-            if isinstance(value, str):
-                score = fuzzy_match(target_value, value)
-                if score >= thresh:
-                    fields_found.append((search_dict, score))
-            elif isinstance(value, list):
-                for item in value:
-                    score = fuzzy_match(target_value, item)
-                    if score >= thresh:
-                        fields_found.append((search_dict, score))
-        elif isinstance(value, dict):
-            fields_found += get_value_recursively_fuzzy(value, field, target_value, thresh)
+    return best_matches(
+        iter_value_recursively_fuzzy(search_dict, field, target_value,
+                                     thresh), limit)
 
-        elif isinstance(value, list):
-            for item in value:
-                if not isinstance(item, dict):
-                    try:
-                        found = get_value_recursively_fuzzy(item.__dict__, field, target_value, thresh)
-                        if len(found):
-                            fields_found.append((item, found[0][1]))
-                    except:
-                        continue  # can't parse
-                else:
-                    fields_found += get_value_recursively_fuzzy(item, field, target_value, thresh)
 
-    return sorted(fields_found, key = lambda i: i[1],reverse=True)
+def freeze(thing):
+    """ hashable version of a json value, values that compare equal are
+    frozen into values that compare (and hash) equal
+
+    raises TypeError for unhashable objects that are not dicts/lists
+    """
+    if isinstance(thing, dict):
+        return frozenset((k, freeze(v)) for k, v in thing.items())
+    if isinstance(thing, (list, tuple)):
+        return tuple(freeze(v) for v in thing)
+    if isinstance(thing, set):
+        return frozenset(freeze(v) for v in thing)
+    hash(thing)
+    return thing
 
 
 def jsonify_recursively(thing):
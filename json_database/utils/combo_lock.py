@@ -12,13 +12,213 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-from threading import Lock
-from fasteners.process_lock import InterProcessLock
+from collections import namedtuple
+from threading import Lock, Condition, local
+from time import perf_counter
+from weakref import WeakValueDictionary
+from fasteners.process_lock import InterProcessLock, \
+    InterProcessReaderWriterLock
 from os.path import exists
 from os import chmod
 
+# lock files known to exist, created once per process
+_LOCK_FILES = set()
 
-class ComboLock:
+
+def _ensure_lock_file(path):
+    # Create lock file if it doesn't exist and set permissions for
+    # all users to lock/unlock
+    if path not in _LOCK_FILES:
+        if not exists(path):
+            f = open(path, 'w+')
+            f.close()
+            chmod(path, 0o777)
+        _LOCK_FILES.add(path)
+
+
+LockEvent = namedtuple("LockEvent", "path kind mode seconds contended")
+LockEvent.__doc__ = """ passed to LockStats callbacks
+
+kind is "thread" or "process" for the time spent waiting for that lock,
+"hold" for the time the lock was held, mode is "exclusive" or "shared"
+"""
+
+
+class Histogram:
+    """ durations in power of two buckets of microseconds, bucket i counts
+    durations bellow 2**i microseconds (and not in a lower bucket) """
+    BUCKETS = 32
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * self.BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        bucket = int(seconds * 1000000).bit_length()
+        self.buckets[min(bucket, self.BUCKETS - 1)] += 1
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        """ upper bound in seconds of the bucket holding the p-th
+        percentile (0 - 100) """
+        if not self.count:
+            return 0.0
+        target = self.count * p / 100
+        seen = 0
+        for bucket, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return min(2 ** bucket / 1000000, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.mean,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            # upper bound in seconds: count
+            "buckets": {2 ** i / 1000000: n
+                        for i, n in enumerate(self.buckets) if n}
+        }
+
+
+class WaitStats:
+    """ waits for one of the locks of a ComboLock """
+    def __init__(self):
+        self.acquired = 0
+        self.contended = 0  # not free on the first try
+        self.failed = 0     # non blocking acquires that gave up
+        self.wait = Histogram()
+
+    def as_dict(self):
+        return {"acquired": self.acquired, "contended": self.contended,
+                "failed": self.failed, "wait": self.wait.as_dict()}
+
+
+class ModeStats:
+    """ thread lock waits, process lock waits and hold times """
+    def __init__(self):
+        self.thread = WaitStats()
+        self.process = WaitStats()
+        self.hold = Histogram()
+
+    def as_dict(self):
+        return {"thread": self.thread.as_dict(),
+                "process": self.process.as_dict(),
+                "hold": self.hold.as_dict()}
+
+
+class LockStats:
+    """ opt-in instrumentation of a lock, see enable_stats()
+
+    exclusive and shared (read) acquisitions are counted separately, every
+    callback is called with a LockEvent after each wait and release
+    """
+    def __init__(self, path, callbacks=None):
+        self.path = path
+        self.exclusive = ModeStats()
+        self.shared = ModeStats()
+        self.callbacks = list(callbacks or [])
+        self._lock = Lock()
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        if callback in self.callbacks:
+            self.callbacks.remove(callback)
+
+    def reset(self):
+        with self._lock:
+            self.exclusive = ModeStats()
+            self.shared = ModeStats()
+
+    def record_wait(self, kind, shared, seconds, contended, acquired=True):
+        with self._lock:
+            mode = self.shared if shared else self.exclusive
+            stats = mode.thread if kind == "thread" else mode.process
+            if acquired:
+                stats.acquired += 1
+                stats.wait.add(seconds)
+            else:
+                stats.failed += 1
+            if contended:
+                stats.contended += 1
+        self._notify(kind, shared, seconds, contended)
+
+    def record_hold(self, shared, seconds):
+        with self._lock:
+            (self.shared if shared else self.exclusive).hold.add(seconds)
+        self._notify("hold", shared, seconds, False)
+
+    def _notify(self, kind, shared, seconds, contended):
+        if self.callbacks:
+            event = LockEvent(self.path, kind,
+                              "shared" if shared else "exclusive",
+                              seconds, contended)
+            for callback in self.callbacks:
+                callback(event)
+
+    def as_dict(self):
+        with self._lock:
+            return {"exclusive": self.exclusive.as_dict(),
+                    "shared": self.shared.as_dict()}
+
+
+def _timed_acquire(acquire, stats, kind, shared, blocking=True):
+    """ acquire a lock recording the wait, acquire(blocking) -> bool """
+    start = perf_counter()
+    if acquire(False):
+        stats.record_wait(kind, shared, perf_counter() - start, False)
+        return True
+    if not blocking:
+        stats.record_wait(kind, shared, perf_counter() - start, True,
+                          acquired=False)
+        return False
+    acquire(True)
+    stats.record_wait(kind, shared, perf_counter() - start, True)
+    return True
+
+
+class _Instrumented:
+    """ stats api shared by the locks, stats is None unless enabled so
+    uninstrumented locks only pay for an attribute check """
+    stats = None
+
+    def enable_stats(self, callbacks=None):
+        """ start collecting wait / hold times and contention counts
+
+        Arguments:
+            callbacks (list): functions called with a LockEvent after every
+                              wait and release
+
+        Returns:
+            LockStats
+        """
+        if self.stats is None:
+            self.stats = LockStats(self.path, callbacks)
+        else:
+            for callback in callbacks or []:
+                self.stats.add_callback(callback)
+        return self.stats
+
+    def disable_stats(self):
+        self.stats = None
+
+
+class ComboLock(_Instrumented):
     """ A combined process and thread lock.
 
     Arguments:
@@ -28,6 +228,7 @@ class ComboLock:
         self.path = path
         self.plock = InterProcessLock(self.path)
         self.tlock = Lock()
+        self._held_since = None
 
     def acquire(self, blocking=True):
         """ Acquire lock, locks thread and process lock.
@@ -38,12 +239,10 @@ class ComboLock:
 
         Returns: True if lock succeeded otherwise False
         """
-        # Create lock file if it doesn't exist and set permissions for
-        # all users to lock/unlock
-        if not exists(self.path):
-            f = open(self.path, 'w+')
-            f.close()
-            chmod(self.path, 0o777)
+        _ensure_lock_file(self.path)
+        stats = self.stats
+        if stats is not None:
+            return self._acquire_timed(stats, blocking)
         if not blocking:
             # Lock thread
             tlocked = self.tlock.acquire(blocking=False)
@@ -60,11 +259,33 @@ class ComboLock:
             self.plock.acquire()
         return True
 
+    def _acquire_timed(self, stats, blocking):
+        if not _timed_acquire(self.tlock.acquire, stats, "thread", False,
+                              blocking):
+            return False
+        if not _timed_acquire(lambda b: self.plock.acquire(blocking=b),
+                              stats, "process", False, blocking):
+            self.tlock.release()
+            return False
+        self._held_since = perf_counter()
+        return True
+
     def release(self):
         """ Release acquired lock. """
+        stats = self.stats
+        if stats is not None and self._held_since is not None:
+            stats.record_hold(False, perf_counter() - self._held_since)
+        self._held_since = None
         self.plock.release()
         self.tlock.release()
 
+    def read_lock(self):
+        """ always exclusive """
+        return self
+
+    def write_lock(self):
+        return self
+
     def __enter__(self):
         """ Context handler, acquires lock in blocking mode. """
         self.acquire()
@@ -75,14 +296,224 @@ class ComboLock:
         self.release()
 
 
-class DummyLock:
+class RWLock:
+    """ A thread reader-writer lock with writer preference.
+
+    Any number of threads can hold the lock for reading, one thread can
+    hold it for writing, once a writer is waiting new readers wait too so
+    writers are not starved. Not reentrant.
+    """
+    def __init__(self):
+        self._cond = Condition(Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self, blocking=True):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                if not blocking:
+                    return False
+                self._cond.wait()
+            self._readers += 1
+            return True
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self, blocking=True):
+        with self._cond:
+            if not blocking and (self._writer or self._readers):
+                return False
+            self._waiting_writers += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+            return True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class _SharedRWState:
+    """ lock state shared by every ComboRWLock of a path in this process,
+    file locks belong to the process so they can not be held per object """
+    def __init__(self, path):
+        self.tlock = RWLock()
+        self.plock = InterProcessReaderWriterLock(path)
+        self.readers = 0  # threads of this process holding the read lock
+        self.readers_lock = Lock()
+        self.stats = None
+        self.held_since = None  # exclusive holder
+        self.read_since = local()  # start times of this thread's reads
+
+
+_STATES = WeakValueDictionary()
+_STATES_LOCK = Lock()
+
+
+class _Guard:
+    def __init__(self, acquire, release):
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        self._acquire()
+        return self
+
+    def __exit__(self, _type, value, traceback):
+        self._release()
+
+
+class ComboRWLock(_Instrumented):
+    """ A combined process and thread reader-writer lock.
+
+    read_lock() is shared between threads and processes, write_lock() (and
+    using the lock itself as a context manager) is exclusive, waiting
+    writers block new readers of this process
+
+    all the locks of a path in this process share their state, including
+    stats
+
+    Arguments:
+        path (str): path to the lockfile for the lock
+    """
+    def __init__(self, path):
+        self.path = path
+        with _STATES_LOCK:
+            state = _STATES.get(path)
+            if state is None:
+                state = _STATES[path] = _SharedRWState(path)
+        self._state = state
+
+    @property
+    def stats(self):
+        return self._state.stats
+
+    @stats.setter
+    def stats(self, stats):
+        self._state.stats = stats
+
+    def acquire_read(self, blocking=True):
+        """ Acquire the lock shared with other readers.
+
+        Returns: True if lock succeeded otherwise False
+        """
+        _ensure_lock_file(self.path)
+        state = self._state
+        stats = state.stats
+        if stats is None:
+            if not state.tlock.acquire_read(blocking):
+                return False
+        elif not _timed_acquire(state.tlock.acquire_read, stats, "thread",
+                                True, blocking):
+            return False
+        with state.readers_lock:
+            # the first reader of the process takes the file lock for all
+            if not state.readers:
+                if stats is None:
+                    locked = state.plock.acquire_read_lock(blocking=blocking)
+                else:
+                    locked = _timed_acquire(
+                        lambda b: state.plock.acquire_read_lock(blocking=b),
+                        stats, "process", True, blocking)
+                if not locked:
+                    state.tlock.release_read()
+                    return False
+            state.readers += 1
+        if stats is not None:
+            starts = getattr(state.read_since, "starts", None)
+            if starts is None:
+                starts = state.read_since.starts = []
+            starts.append(perf_counter())
+        return True
+
+    def release_read(self):
+        state = self._state
+        stats = state.stats
+        starts = getattr(state.read_since, "starts", None)
+        if starts:
+            start = starts.pop()
+            if stats is not None:
+                stats.record_hold(True, perf_counter() - start)
+        with state.readers_lock:
+            state.readers -= 1
+            if not state.readers:
+                state.plock.release_read_lock()
+        state.tlock.release_read()
+
+    def acquire(self, blocking=True):
+        """ Acquire the lock exclusively.
+
+        Returns: True if lock succeeded otherwise False
+        """
+        _ensure_lock_file(self.path)
+        state = self._state
+        stats = state.stats
+        if stats is None:
+            if not state.tlock.acquire_write(blocking):
+                return False
+            # no other thread of this process holds the file lock now
+            if not state.plock.acquire_write_lock(blocking=blocking):
+                state.tlock.release_write()
+                return False
+            return True
+        if not _timed_acquire(state.tlock.acquire_write, stats, "thread",
+                              False, blocking):
+            return False
+        if not _timed_acquire(
+                lambda b: state.plock.acquire_write_lock(blocking=b),
+                stats, "process", False, blocking):
+            state.tlock.release_write()
+            return False
+        state.held_since = perf_counter()
+        return True
+
+    def release(self):
+        state = self._state
+        if state.stats is not None and state.held_since is not None:
+            state.stats.record_hold(False, perf_counter() - state.held_since)
+        state.held_since = None
+        state.plock.release_write_lock()
+        state.tlock.release_write()
+
+    def read_lock(self):
+        """ context manager holding the shared lock """
+        return _Guard(self.acquire_read, self.release_read)
+
+    def write_lock(self):
+        """ context manager holding the exclusive lock """
+        return self
+
+    def __enter__(self):
+        """ Context handler, acquires lock in blocking mode. """
+        self.acquire()
+        return self
+
+    def __exit__(self, _type, value, traceback):
+        """ Releases the lock. """
+        self.release()
+
+
+class DummyLock(_Instrumented):
     """ A combined process and thread lock.
 
+    Nothing is locked, with stats enabled only hold times are recorded
+
     Arguments:
         path (str): path to the lockfile for the lock
     """
     def __init__(self, path):
         self.path = path
+        self._held_since = local()
 
     def acquire(self, blocking=True):
         """ Acquire lock, locks thread and process lock.
@@ -93,16 +524,32 @@ class DummyLock:
 
         Returns: True if lock succeeded otherwise False
         """
+        if self.stats is not None:
+            starts = getattr(self._held_since, "starts", None)
+            if starts is None:
+                starts = self._held_since.starts = []
+            starts.append(perf_counter())
         return True
 
     def release(self):
         """ Release acquired lock. """
-        pass
+        starts = getattr(self._held_since, "starts", None)
+        if starts:
+            start = starts.pop()
+            if self.stats is not None:
+                self.stats.record_hold(False, perf_counter() - start)
+
+    def read_lock(self):
+        return self
+
+    def write_lock(self):
+        return self
 
     def __enter__(self):
         """ Context handler, acquires lock in blocking mode. """
+        self.acquire()
         return self
 
     def __exit__(self, _type, value, traceback):
         """ Releases the lock. """
-        pass
+        self.release()
@@ -0,0 +1,82 @@
+import gzip
+import lzma
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def _open_gzip(path, mode, encoding=None):
+    # level 6 compresses nearly as well as 9 in a fraction of the time
+    return gzip.open(path, mode, compresslevel=6, encoding=encoding)
+
+
+def _open_lzma(path, mode, encoding=None):
+    return lzma.open(path, mode, encoding=encoding)
+
+
+def _open_zstd(path, mode, encoding=None):
+    return zstandard.open(path, mode, encoding=encoding)
+
+
+# name: (magic bytes, file extension, opener)
+COMPRESSIONS = {
+    "gzip": (b"\x1f\x8b", ".gz", _open_gzip),
+    "lzma": (b"\xfd7zXZ\x00", ".xz", _open_lzma),
+    "zstd": (b"\x28\xb5\x2f\xfd", ".zst", _open_zstd)
+}
+
+
+def check_compression(compression):
+    """ raise if a compression can not be used """
+    if compression is None:
+        return
+    if compression not in COMPRESSIONS:
+        raise ValueError("unknown compression: " + str(compression))
+    if compression == "zstd" and zstandard is None:
+        raise ImportError("zstd compression needs the zstandard package")
+
+
+def compression_from_extension(path):
+    """ compression implied by the file extension, None if uncompressed """
+    for name, (_, extension, _) in COMPRESSIONS.items():
+        if path.endswith(extension):
+            return name
+    return None
+
+
+def detect_compression(path):
+    """ compression used by an existing file, from its first bytes
+
+    Returns:
+        str: "gzip", "lzma", "zstd" or None if the file is not compressed
+    """
+    with open(path, "rb") as f:
+        head = f.read(8)
+    for name, (magic, _, _) in COMPRESSIONS.items():
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def open_file(path, mode="r", compression=None):
+    """ open a file, (de)compressing it on the fly
+
+    Args:
+        path (str): file to open
+        mode (str): "r", "w", "rb" or "wb", text is utf-8
+        compression (str): "gzip", "lzma", "zstd" or None
+
+    Returns:
+        file object
+    """
+    if compression is None:
+        if "b" in mode:
+            return open(path, mode)
+        return open(path, mode, encoding="utf-8")
+    check_compression(compression)
+    opener = COMPRESSIONS[compression][2]
+    if "b" in mode:
+        return opener(path, mode)
+    return opener(path, mode + "t", encoding="utf-8")
@@ -0,0 +1,97 @@
+import atexit
+import logging
+import time
+import weakref
+from threading import Thread, Lock
+
+LOG = logging.getLogger("JsonDatabase")
+
+_FLUSHERS = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_all():
+    """ write anything still pending when the interpreter exits """
+    for flusher in list(_FLUSHERS):
+        flusher.flush()
+
+
+class BackgroundFlusher:
+    """ Coalesces write requests into at most one write per interval.
+
+    Requests only mark the data dirty, a background thread calls the write
+    function once the interval since the previous write has elapsed, the
+    thread exits when there is nothing left to write
+
+    Arguments:
+        write (callable): bound method that writes the data
+        interval (float): minimum number of seconds between writes
+    """
+    def __init__(self, write, interval=1.0):
+        self._write = weakref.WeakMethod(write)
+        self.interval = interval
+        self._pending = None  # strong reference to write() while dirty
+        self._lock = Lock()
+        self._write_lock = Lock()
+        self._thread = None
+        self._last_write = 0
+        _FLUSHERS.add(self)
+
+    @property
+    def dirty(self):
+        return self._pending is not None
+
+    def schedule(self, write=None):
+        """ request a write, returns immediately """
+        with self._lock:
+            if self._pending is None:
+                self._pending = write or self._write()
+            if self._thread is None:
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def cancel(self):
+        """ drop the pending write """
+        with self._lock:
+            self._pending = None
+
+    def flush(self):
+        """ perform the pending write now, waits for a write in progress """
+        with self._lock:
+            write, self._pending = self._pending, None
+        with self._write_lock:
+            if write is not None:
+                self._do_write(write)
+
+    def _run(self):
+        while True:
+            delay = self._last_write + self.interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self._lock:
+                write, self._pending = self._pending, None
+                if write is None:
+                    self._thread = None
+                    return
+            with self._write_lock:
+                self._do_write(write)
+
+    def _do_write(self, write):
+        error = None
+        for _ in range(3):
+            try:
+                write()
+                error = None
+                break
+            except RuntimeError as e:
+                # data changed size while being serialized, try again
+                error = e
+            except Exception as e:
+                error = e
+                break
+        self._last_write = time.monotonic()
+        if error is not None:
+            LOG.error("background write failed, retrying in {} seconds: "
+                      "{}".format(self.interval, repr(error)))
+            # keep the data dirty, written on the next interval or at exit
+            self.schedule(write)
@@ -0,0 +1,198 @@
+import json
+from os import stat, remove, fsync
+from os.path import isfile
+from threading import Lock
+
+
+def _json_key(key):
+    """ dict keys are strings once they go through json, mirror that """
+    if isinstance(key, str):
+        return key
+    return json.dumps(key)
+
+
+class Journal:
+    """ Append-only log of mutations applied on top of a json snapshot.
+
+    Every line of the journal file is a json object describing one change,
+    the first line records the size and mtime of the snapshot the changes
+    apply to, if the snapshot is rewritten the journal is considered stale
+    and ignored.
+
+    Arguments:
+        path (str): path of the journal file
+        snapshot (str): path of the json file the journal applies to
+        threshold (int): journal size in bytes that triggers a checkpoint,
+                         by default half of the snapshot size (min 1 MiB)
+    """
+    MIN_THRESHOLD = 1024 * 1024
+
+    def __init__(self, path, snapshot, threshold=None):
+        self.path = path
+        self.snapshot = snapshot
+        self.threshold = threshold
+        self.pending = []
+        self.pending_size = 0
+        self.written = 0  # entries taken from pending by write()
+        self.invalid = False
+        # changes may be recorded while a background thread writes
+        self._lock = Lock()
+
+    @property
+    def dirty(self):
+        return self.invalid or bool(self.pending)
+
+    def record(self, op, key=None, **kwargs):
+        """ queue a change, it is written to disk on next write() """
+        if self.invalid:
+            return
+        entry = {"op": op}
+        if key is not None:
+            entry["key"] = _json_key(key)
+        entry.update(kwargs)
+        try:
+            line = json.dumps(entry, ensure_ascii=False)
+        except (TypeError, ValueError):
+            # not serializable (yet?), a full snapshot is needed
+            self.invalidate()
+            return
+        with self._lock:
+            self.pending.append(line)
+            self.pending_size += len(line) + 1
+
+    def position(self):
+        """ number of changes recorded so far, see truncate() """
+        return self.written + len(self.pending)
+
+    def invalidate(self):
+        """ in memory data diverged from snapshot + journal, next store
+        must write a full snapshot """
+        with self._lock:
+            self.invalid = True
+            self.pending = []
+            self.pending_size = 0
+
+    def truncate(self, position):
+        """ forget the changes recorded after position() returned position,
+        invalidates the journal if some of them were written already """
+        with self._lock:
+            count = position - self.written
+            if count < 0:
+                self.invalid = True
+                count = 0
+            for line in self.pending[count:]:
+                self.pending_size -= len(line) + 1
+            del self.pending[count:]
+
+    def discard(self):
+        """ forget queued changes, called after (re)loading from disk """
+        with self._lock:
+            self.invalid = False
+            self.pending = []
+            self.pending_size = 0
+
+    def _snapshot_signature(self):
+        st = stat(self.snapshot)
+        return {"op": "base", "size": st.st_size, "mtime": st.st_mtime_ns}
+
+    def _read_base(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.loads(f.readline())
+        except (OSError, ValueError):
+            return None
+
+    def is_valid(self):
+        """ journal file exists and applies to the current snapshot """
+        if not isfile(self.path) or not isfile(self.snapshot):
+            return False
+        return self._read_base() == self._snapshot_signature()
+
+    def size(self):
+        try:
+            return stat(self.path).st_size
+        except OSError:
+            return 0
+
+    def needs_checkpoint(self):
+        """ True if the next write should be a full snapshot instead """
+        if self.invalid or not isfile(self.snapshot):
+            return True
+        if isfile(self.path) and not self.is_valid():
+            return True
+        threshold = self.threshold
+        if threshold is None:
+            threshold = max(self.MIN_THRESHOLD,
+                            stat(self.snapshot).st_size // 2)
+        return self.size() + self.pending_size > threshold
+
+    def write(self):
+        """ append queued changes to the journal file, changes recorded
+        while writing stay queued for the next write """
+        with self._lock:
+            lines = list(self.pending)
+        if not lines:
+            return
+        header = None
+        if not isfile(self.path):
+            header = json.dumps(self._snapshot_signature())
+        with open(self.path, "a", encoding="utf-8") as f:
+            if header:
+                f.write(header + "\n")
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            fsync(f.fileno())
+        with self._lock:
+            if self.invalid:
+                return  # pending was dropped meanwhile
+            del self.pending[:len(lines)]
+            self.pending_size -= sum(len(line) + 1 for line in lines)
+            self.written += len(lines)
+
+    def reset(self):
+        """ drop the journal, called after a checkpoint """
+        self.discard()
+        if isfile(self.path):
+            remove(self.path)
+
+    def replay(self, data):
+        """ apply journaled changes on top of a freshly loaded snapshot
+
+        Returns:
+            int: number of changes applied
+        """
+        count = 0
+        with open(self.path, encoding="utf-8") as f:
+            f.readline()  # snapshot signature
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # torn write, everything after is lost
+                self.apply(data, entry)
+                count += 1
+        return count
+
+    @staticmethod
+    def apply(data, entry):
+        op = entry["op"]
+        key = entry.get("key")
+        if op == "set":
+            dict.__setitem__(data, key, entry["value"])
+        elif op == "del":
+            dict.pop(data, key, None)
+        elif op == "clear":
+            dict.clear(data)
+        elif op == "append":
+            dict.__getitem__(data, key).append(entry["value"])
+        elif op == "extend":
+            dict.__getitem__(data, key).extend(entry["values"])
+        elif op == "update":
+            dict.__getitem__(data, key)[entry["idx"]] = entry["value"]
+        elif op == "remove":
+            dict.__getitem__(data, key).pop(entry["idx"])
+        else:
+            raise ValueError("unknown journal operation: " + str(op))
@@ -0,0 +1,176 @@
+import json
+from json_database.utils.compression import open_file
+from json_database.utils.stream import load_json_stream
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# first byte of a msgpack map or array, never valid at the start of json
+_MSGPACK_MARKERS = set(range(0x80, 0xa0)) | {0xdc, 0xdd, 0xde, 0xdf}
+
+
+class Serializer:
+    """ reads and writes the contents of a JsonStorage file
+
+    Subclasses implement dump() and load() on a file object opened in
+    binary mode if binary is True, else in text mode, files can be
+    compressed with any of utils.compression.COMPRESSIONS
+    """
+    name = None
+    binary = False
+    text = False  # writes (and can read) json text
+
+    @property
+    def available(self):
+        return True
+
+    def _open(self, path, mode, compression=None):
+        if self.binary:
+            mode += "b"
+        return open_file(path, mode, compression)
+
+    def dump(self, data, f):
+        raise NotImplementedError
+
+    def load(self, f):
+        raise NotImplementedError
+
+    def dump_file(self, data, path, compression=None):
+        with self._open(path, "w", compression) as f:
+            self.dump(data, f)
+
+    def load_file(self, path, compression=None):
+        with self._open(path, "r", compression) as f:
+            return self.load(f)
+
+
+class JsonSerializer(Serializer):
+    """ human readable json, comment lines are ignored on load """
+    name = "json"
+    text = True
+
+    def __init__(self, indent=4):
+        self.indent = indent
+
+    def dump(self, data, f):
+        json.dump(data, f, indent=self.indent, ensure_ascii=False)
+
+    def load(self, f):
+        return load_json_stream(f)
+
+
+class CompactJsonSerializer(JsonSerializer):
+    """ json without any whitespace """
+    name = "json-compact"
+
+    def __init__(self):
+        super().__init__(indent=None)
+
+    def dump(self, data, f):
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+
+
+class OrjsonSerializer(Serializer):
+    """ compact json encoded and decoded with orjson
+
+    values orjson can not handle (eg. integers over 64 bits, NaN) and
+    commented files fall back to the standard json module
+    """
+    name = "orjson"
+    binary = True
+    text = True
+
+    @property
+    def available(self):
+        return orjson is not None
+
+    def dump(self, data, f):
+        try:
+            f.write(orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS))
+        except (TypeError, OverflowError):
+            f.write(json.dumps(data, ensure_ascii=False,
+                               separators=(",", ":")).encode("utf-8"))
+
+    def load_file(self, path, compression=None):
+        with self._open(path, "r", compression) as f:
+            try:
+                return orjson.loads(f.read())
+            except orjson.JSONDecodeError:
+                pass  # comments, NaN ...
+        return SERIALIZERS["json"].load_file(path, compression)
+
+
+class MsgpackSerializer(Serializer):
+    """ MessagePack binary encoding, smaller and faster than json but not
+    human readable, dict keys are kept as they are instead of converted to
+    strings """
+    name = "msgpack"
+    binary = True
+
+    @property
+    def available(self):
+        return msgpack is not None
+
+    def dump(self, data, f):
+        msgpack.pack(data, f, use_bin_type=True)
+
+    def load(self, f):
+        return msgpack.unpack(f, raw=False, strict_map_key=False)
+
+
+SERIALIZERS = {
+    "json": JsonSerializer(),
+    "json-compact": CompactJsonSerializer(),
+    "orjson": OrjsonSerializer(),
+    "msgpack": MsgpackSerializer()
+}
+
+
+def get_serializer(serializer=None):
+    """ Serializer instance from its name
+
+    Args:
+        serializer (str|Serializer): "json" (default), "json-compact",
+                                     "orjson", "msgpack" or an instance
+
+    Returns:
+        Serializer
+    """
+    if serializer is None:
+        serializer = "json"
+    if isinstance(serializer, str):
+        if serializer not in SERIALIZERS:
+            raise ValueError("unknown serializer: " + serializer)
+        serializer = SERIALIZERS[serializer]
+    if not serializer.available:
+        raise ImportError("serializer '{}' needs the {} package".format(
+            serializer.name, serializer.name))
+    return serializer
+
+
+def detect_serializer(path, default=None, compression=None):
+    """ Serializer able to read a file, files are written in json unless
+    they start like a MessagePack map/array
+
+    Args:
+        path (str): file to inspect
+        default (Serializer): used for json files if it can read them
+        compression (str): compression of the file
+
+    Returns:
+        Serializer
+    """
+    with open_file(path, "rb", compression) as f:
+        head = f.read(1)
+    if head and head[0] in _MSGPACK_MARKERS:
+        return get_serializer("msgpack")
+    if default is not None and default.text:
+        return default
+    return SERIALIZERS["json"]
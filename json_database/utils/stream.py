@@ -0,0 +1,204 @@
+import json
+import re
+
+CHUNK_SIZE = 64 * 1024
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER_CHARS = "0123456789.eE+-"
+_COMMENT_LINES = re.compile(r"^[^\S\n]*(?://|#).*\n", re.MULTILINE)
+
+
+def _is_comment(line):
+    stripped = line.lstrip()
+    return stripped.startswith("//") or stripped.startswith("#")
+
+
+def iter_uncommented(f, chunk_size=CHUNK_SIZE):
+    """ yields the text of a commented json file without the comment lines
+
+    same rules as uncomment_json, lines starting with '//' or '#' are
+    dropped and the others are joined with a space, but the file is read
+    chunk_size characters at a time instead of all at once
+
+    Args:
+        f (file): commented json file opened in text mode
+        chunk_size (int): number of characters read at once
+    """
+    carry = ""         # start of a line that continues in the next chunk
+    decided = False    # carry was already yielded (or dropped)
+    skipping = False   # carry belongs to a comment line
+    while True:
+        block = f.read(chunk_size)
+        if not block:
+            break
+        text = carry + block
+        cut = text.rfind("\n") + 1
+        head, carry = text[:cut], text[cut:]
+        if head:
+            if decided:
+                # end of a long line whose start is already handled
+                nl = head.index("\n")
+                if not skipping:
+                    yield head[:nl] + " "
+                head = head[nl + 1:]
+                decided = skipping = False
+            if "#" in head or "//" in head:
+                head = _COMMENT_LINES.sub("", head)
+            yield head.replace("\n", " ")
+        if len(carry) >= chunk_size:
+            # long line, do not keep it all in memory
+            if not decided:
+                stripped = carry.lstrip()
+                if stripped in ("", "/"):
+                    continue  # can not tell if it is a comment yet
+                decided = True
+                skipping = _is_comment(carry)
+            if not skipping:
+                yield carry
+            carry = ""
+    if carry and not skipping and (decided or not _is_comment(carry)):
+        yield carry
+
+
+class _Reader:
+    """ decodes json values from a stream of text chunks, only the text of
+    the value being decoded is kept in memory """
+    def __init__(self, chunks, chunk_size=CHUNK_SIZE):
+        self.chunks = chunks
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _read(self, size):
+        """ drop the decoded text and read at least size more characters """
+        parts = [self.buf[self.pos:]]
+        n = 0
+        for piece in self.chunks:
+            parts.append(piece)
+            n += len(piece)
+            if n >= size:
+                break
+        else:
+            self.eof = True
+        self.buf = "".join(parts)
+        self.pos = 0
+
+    def peek(self):
+        """ next non whitespace character, "" at the end of the text """
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                return ""
+            self._read(self.chunk_size)
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError("expected one of {} at '{}'".format(
+                list(chars), self.buf[self.pos:self.pos + 20]))
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buf, self.pos)
+                # a number could continue in the next chunk
+                if self.eof or (end < len(self.buf) and
+                                self.buf[end] not in _NUMBER_CHARS):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._read(size)
+            size *= 2
+
+
+def _iter_array(reader):
+    reader.expect("[")
+    if reader.peek() == "]":
+        reader.pos += 1
+        return
+    while True:
+        yield reader.value()
+        if reader.expect(",]") == "]":
+            return
+
+
+def _iter_object(reader):
+    """ yields (key, value, is_list) for every key of the top level object,
+    list values are yielded as generators of their items which must be
+    consumed before the next key is read """
+    reader.expect("{")
+    if reader.peek() == "}":
+        reader.pos += 1
+        return
+    while True:
+        key = reader.value()
+        if not isinstance(key, str):
+            raise ValueError("object keys must be strings")
+        reader.expect(":")
+        if reader.peek() == "[":
+            items = _iter_array(reader)
+            yield key, items, True
+            for _ in items:
+                pass  # the consumer skipped the list
+        else:
+            yield key, reader.value(), False
+        if reader.expect(",}") == "}":
+            return
+
+
+def _check_end(reader):
+    if reader.peek():
+        raise ValueError("extra data after the json value")
+
+
+def load_json_stream(f, chunk_size=CHUNK_SIZE):
+    """ decode a commented json file incrementally
+
+    top level lists are decoded one element at a time, so besides the
+    decoded data only about one element worth of text is kept in memory
+
+    Args:
+        f (file): commented json file opened in text mode
+        chunk_size (int): number of characters read at once
+
+    Returns:
+        obj: decoded Python object
+    """
+    reader = _Reader(iter_uncommented(f, chunk_size), chunk_size)
+    if reader.peek() != "{":
+        value = reader.value()
+        _check_end(reader)
+        return value
+    data = {}
+    for key, value, is_list in _iter_object(reader):
+        data[key] = list(value) if is_list else value
+    _check_end(reader)
+    return data
+
+
+def iter_json_items(filename, key, chunk_size=CHUNK_SIZE):
+    """ yields the elements of the top level list filename[key] one at a
+    time, without loading the whole file
+
+    Args:
+        filename (str): path to the commented JSON file
+        key (str): top level key holding the list, eg. a JsonDatabase name
+        chunk_size (int): number of characters read at once
+    """
+    with open(filename, encoding='utf-8') as f:
+        reader = _Reader(iter_uncommented(f, chunk_size), chunk_size)
+        if reader.peek() != "{":
+            return
+        for k, value, is_list in _iter_object(reader):
+            if k == key and is_list:
+                yield from value
@@ -0,0 +1,204 @@
+def track(value, owner, key, root=None):
+    """ tracked copy of a dict / list and of everything nested in it, other
+    values are returned as is
+
+    Arguments:
+        value: value to track
+        owner: object with a _touch(key, container) method, called before
+               every change
+        key: top level key of owner the value belongs to
+        root: tracked top level value (or database item) value is nested
+              in, None if value is the top level value
+    """
+    cls = type(value)
+    if cls is TrackedDict or cls is TrackedList:
+        if value._owner is owner and value._key == key and \
+                value._root is (value if root is None else root):
+            return value
+        # moved from somewhere else, changes must be reported here
+        cls = dict if cls is TrackedDict else list
+    if cls is dict:
+        return TrackedDict(value, owner, key, root)
+    if cls is list:
+        return TrackedList(value, owner, key, root)
+    return value
+
+
+def plain_copy(value):
+    """ deep copy of a json value, tracked containers become plain ones """
+    if isinstance(value, dict):
+        return {k: plain_copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [plain_copy(v) for v in value]
+    return value
+
+
+def refill(value, data):
+    """ replace the contents of the dict / list value with data, without
+    reporting a change """
+    if isinstance(value, (TrackedDict, TrackedList)):
+        value._restore(data)
+    elif isinstance(value, dict):
+        dict.clear(value)
+        dict.update(value, data)
+    else:
+        list.__setitem__(value, slice(None), data)
+
+
+class TrackedDict(dict):
+    """ dict that reports changes made to it, or to the dicts and lists
+    nested in it, to its owner
+
+    reading is as fast as with a plain dict, values stored in it are
+    tracked too, pickling / copying gives plain dicts
+    """
+    __slots__ = ("_owner", "_key", "_root")
+
+    def __init__(self, data, owner, key, root=None):
+        super().__init__(data)
+        self._owner = owner
+        self._key = key
+        self._root = self if root is None else root
+        self._track_children()
+
+    def _track_children(self):
+        for k, v in dict.items(self):
+            if isinstance(v, (dict, list)):
+                dict.__setitem__(self, k, self._track(v))
+
+    def _restore(self, data):
+        """ replace the contents without reporting a change """
+        dict.clear(self)
+        dict.update(self, data)
+        self._track_children()
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+    def _touch(self):
+        self._owner._touch(self._key, self)
+
+    def _track(self, value):
+        return track(value, self._owner, self._key, self._root)
+
+    # changes are reported before they are made, so the owner can keep a
+    # copy of the old value
+    def __setitem__(self, key, value):
+        self._touch()
+        dict.__setitem__(self, key, self._track(value))
+
+    def __delitem__(self, key):
+        self._touch()
+        dict.__delitem__(self, key)
+
+    def pop(self, key, *args):
+        self._touch()
+        return dict.pop(self, key, *args)
+
+    def popitem(self):
+        self._touch()
+        return dict.popitem(self)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        self._touch()
+        for key, value in dict(*args, **kwargs).items():
+            dict.__setitem__(self, key, self._track(value))
+
+    def clear(self):
+        self._touch()
+        dict.clear(self)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+
+class TrackedList(list):
+    """ list that reports changes made to it, or to the dicts and lists
+    nested in it, to its owner, see TrackedDict """
+    __slots__ = ("_owner", "_key", "_root")
+
+    def __init__(self, data, owner, key, root=None):
+        super().__init__(data)
+        self._owner = owner
+        self._key = key
+        self._root = self if root is None else root
+        self._track_children()
+
+    def _track_children(self):
+        for i, v in enumerate(list.__iter__(self)):
+            if isinstance(v, (dict, list)):
+                list.__setitem__(self, i, self._track(v))
+
+    def _restore(self, data):
+        """ replace the contents without reporting a change """
+        list.__setitem__(self, slice(None), data)
+        self._track_children()
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+    def _touch(self):
+        self._owner._touch(self._key, self)
+
+    def _track(self, value):
+        return track(value, self._owner, self._key, self._root)
+
+    def __setitem__(self, idx, value):
+        if isinstance(idx, slice):
+            value = [self._track(v) for v in value]
+        else:
+            value = self._track(value)
+        self._touch()
+        list.__setitem__(self, idx, value)
+
+    def __delitem__(self, idx):
+        self._touch()
+        list.__delitem__(self, idx)
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __imul__(self, n):
+        self._touch()
+        list.__imul__(self, n)
+        return self
+
+    def append(self, value):
+        self._touch()
+        list.append(self, self._track(value))
+
+    def extend(self, values):
+        values = [self._track(v) for v in values]
+        self._touch()
+        list.extend(self, values)
+
+    def insert(self, idx, value):
+        self._touch()
+        list.insert(self, idx, self._track(value))
+
+    def pop(self, *args):
+        self._touch()
+        return list.pop(self, *args)
+
+    def remove(self, value):
+        self._touch()
+        list.remove(self, value)
+
+    def clear(self):
+        self._touch()
+        list.clear(self)
+
+    def sort(self, *args, **kwargs):
+        self._touch()
+        list.sort(self, *args, **kwargs)
+
+    def reverse(self):
+        self._touch()
+        list.reverse(self)
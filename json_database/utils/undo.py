@@ -0,0 +1,52 @@
+class UndoLog:
+    """ how to revert the changes made during a transaction
+
+    every change adds a function that reverts it, rolling back calls them
+    in reverse order so the cost is proportional to the changes made, not
+    to the size of the data
+
+    values changed in place are copied once per savepoint before their
+    first change, replaced or deleted values are kept as they are
+    """
+    def __init__(self):
+        self.entries = []     # (function, args)
+        self.savepoints = []  # (len(entries), ids of copied values, state)
+
+    def __len__(self):
+        return len(self.savepoints)
+
+    def add(self, func, *args):
+        self.entries.append((func, args))
+
+    def first_change(self, value):
+        """ True the first time value changes in place since the last
+        savepoint, the caller then adds an entry restoring a copy of it, the
+        entry keeps value alive so its id stays unique """
+        copied = self.savepoints[-1][1]
+        if id(value) in copied:
+            return False
+        copied.add(id(value))
+        return True
+
+    def savepoint(self, state=None):
+        """ start a (nested) savepoint, state is handed back by rollback """
+        self.savepoints.append((len(self.entries), set(), state))
+
+    def release(self):
+        """ keep the changes made since the last savepoint, they are still
+        reverted if an outer savepoint rolls back """
+        mark, copied, state = self.savepoints.pop()
+        if self.savepoints:
+            self.savepoints[-1][1].update(copied)
+
+    def rollback(self):
+        """ revert the changes made since the last savepoint
+
+        Returns:
+            the state given to savepoint()
+        """
+        mark, copied, state = self.savepoints.pop()
+        while len(self.entries) > mark:
+            func, args = self.entries.pop()
+            func(*args)
+        return state
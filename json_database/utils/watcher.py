@@ -0,0 +1,149 @@
+import logging
+import weakref
+from os import stat
+from os.path import dirname, basename, abspath
+from threading import Thread, Event, current_thread
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+LOG = logging.getLogger("JsonDatabase")
+
+
+class _Missing:
+    """ old value of added keys / new value of removed keys """
+    def __repr__(self):
+        return "MISSING"
+
+    def __bool__(self):
+        return False
+
+
+MISSING = _Missing()
+
+
+def _stat_signature(paths):
+    signature = []
+    for path in paths:
+        try:
+            st = stat(path)
+            signature.append((st.st_mtime_ns, st.st_size, st.st_ino))
+        except OSError:
+            signature.append(None)
+    return signature
+
+
+class FileWatcher:
+    """ Calls a function from a background thread when files change.
+
+    Uses inotify if the inotify_simple package is installed (linux), else
+    polls the size / mtime of the files every interval seconds, bursts of
+    events are coalesced into one call. The files do not need to exist and
+    can be replaced by a rename.
+
+    The watch is armed by start() itself, changes made once it returns are
+    never missed. The watcher only keeps a weak reference to bound methods,
+    it stops by itself once their object is garbage collected
+
+    Arguments:
+        paths (list): files to watch
+        callback (callable): called without arguments after changes
+        interval (float): seconds between polls, also the longest delay
+                          before stop() is noticed with inotify
+        use_inotify (bool): set to False to always poll
+    """
+    def __init__(self, paths, callback, interval=0.5, use_inotify=True):
+        self.paths = [abspath(p) for p in paths]
+        if hasattr(callback, "__self__"):
+            self._callback = weakref.WeakMethod(callback)
+        else:
+            self._callback = lambda: callback
+        self.interval = interval
+        self.use_inotify = use_inotify and inotify_simple is not None
+        self._stop = Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        # armed here, not in the thread, so nothing written after start()
+        # returns goes unnoticed
+        inotify = self._arm_inotify() if self.use_inotify else None
+        if inotify is not None:
+            target, args = self._run_inotify, (inotify,)
+        else:
+            target, args = self._run_polling, (_stat_signature(self.paths),)
+        self._thread = Thread(target=target, args=args, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ stop watching, waits for a callback in progress """
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive() and \
+                thread is not current_thread():
+            thread.join()
+
+    def _notify(self):
+        callback = self._callback()
+        if callback is None:
+            # owner is gone
+            self._stop.set()
+            return
+        try:
+            callback()
+        except Exception as e:
+            LOG.error("file watcher callback failed: " + repr(e))
+
+    def _run_polling(self, last):
+        """ last: signature of the files when the watch was armed """
+        while not self._stop.wait(self.interval):
+            current = _stat_signature(self.paths)
+            if current != last:
+                last = current
+                self._notify()
+
+    def _arm_inotify(self):
+        """ INotify watching the folders of the files, None if inotify can
+        not be used """
+        flags = inotify_simple.flags
+        # not MODIFY, files are only read once fully written
+        mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | \
+            flags.DELETE
+        inotify = inotify_simple.INotify()
+        try:
+            # watch the folders, files are replaced by renaming over them
+            for folder in {dirname(p) for p in self.paths}:
+                inotify.add_watch(folder, mask)
+        except OSError as e:
+            # folder missing, out of watches ...
+            LOG.warning("inotify failed, polling instead: " + repr(e))
+            inotify.close()
+            return None
+        return inotify
+
+    def _run_inotify(self, inotify):
+        names = {basename(p) for p in self.paths}
+        try:
+            timeout = int(self.interval * 1000)
+            while not self._stop.is_set():
+                # read_delay coalesces the events of a burst of writes
+                events = inotify.read(timeout=timeout, read_delay=20)
+                if any(e.name in names for e in events) and \
+                        not self._stop.is_set():
+                    self._notify()
+        except OSError as e:
+            LOG.warning("inotify failed, polling instead: " + repr(e))
+            last = _stat_signature(self.paths)
+            # changes made before the polling started
+            self._notify()
+            self._run_polling(last)
+        finally:
+            inotify.close()
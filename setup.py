@@ -8,6 +8,12 @@ setup(
     license='MIT',
     author='jarbasAI',
     author_email='jarbasai@mailfence.com',
-    install_requires=["pyxdg", "fasteners"],
+    install_requires=["pyxdg", "fasteners>=0.16"],
+    extras_require={
+        "orjson": ["orjson"],
+        "msgpack": ["msgpack"],
+        "zstd": ["zstandard"],
+        "watch": ["inotify_simple"]
+    },
     description='searchable json database with persistence'
 )